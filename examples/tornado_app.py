@@ -13,6 +13,10 @@ class settings:
     API_SECRET = None
 
 
+# One client shared by all requests; its connections and caches too.
+client = None
+
+
 class LastfmHandler(tornado.web.RequestHandler):
 
     @tornado.gen.coroutine
@@ -24,11 +28,6 @@ class LastfmHandler(tornado.web.RequestHandler):
             self.finish()
 
     def redirect_to_lastfm(self):
-        client = AsyncLastfmClient(
-            api_key=settings.API_KEY,
-            api_secret=settings.API_SECRET,
-        )
-
         auth_url = client.get_auth_url(callback_url='%s://%s/' % (
             self.request.protocol,
             self.request.host
@@ -38,25 +37,21 @@ class LastfmHandler(tornado.web.RequestHandler):
 
     @tornado.gen.coroutine
     def back_from_lastfm(self):
-
-        client = AsyncLastfmClient(
-            api_key=settings.API_KEY,
-            api_secret=settings.API_SECRET,
-        )
         token = self.get_argument('token')
 
         print('Fetching session...')
         session = yield client.auth.get_session(token)
 
-        client.session_key = session['key']
+        # A cheap view of the shared client, signing with the user's key.
+        api = client.for_session(session['key'])
 
         print('Fetching user info...')
-        user = yield client.user.get_info()
+        user = yield api.user.get_info()
 
         print('Fetching tracks and friends simultaneously...')
         tracks, friends = yield [
-            client.user.get_recent_tracks(user=user['name'], limit=3),
-            client.user.get_friends(user=user['name'], limit=3)
+            api.user.get_recent_tracks(user=user['name'], limit=3),
+            api.user.get_friends(user=user['name'], limit=3)
         ]
 
         print('Finishing.')
@@ -79,6 +74,10 @@ if __name__ == '__main__':
     args = parser.parse_args()
     settings.API_KEY = args.api_key
     settings.API_SECRET = args.api_secret
+    client = AsyncLastfmClient(
+        api_key=settings.API_KEY,
+        api_secret=settings.API_SECRET,
+    )
 
     # Start our app:
     app = tornado.web.Application(
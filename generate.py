@@ -3,7 +3,8 @@ import sys
 import json
 import textwrap
 from io import StringIO
-from collections import defaultdict
+from fnmatch import fnmatchcase
+from collections import defaultdict, OrderedDict
 from datetime import datetime
 
 import requests
@@ -106,27 +107,22 @@ def generate_spec(root='http://www.last.fm'):
     print json.dumps(spec, indent=4, sort_keys=True)
 
 
-def generate_code(specfile='api.json'):
+def generate_code(specfile='api.json', policyfile='cache_policy.json',
+                  invalidationfile='cache_invalidation.json'):
     """Take a path to a spec file and generate the actual Python code."""
 
     spec = json.load(open(specfile))
     del spec['__generated__']
+    policy = json.load(open(policyfile), object_pairs_hook=OrderedDict)
+    invalidation = json.load(open(invalidationfile))
 
     out = StringIO()
     out.write(u'# Generated code. Do not edit.\n')
     out.write(u'# %s\n' % now())
-    out.write(u'from .package import Package\n\n\n')
+    out.write(u'from .package import Package, package_property\n\n\n')
 
     packages = sorted(spec.keys())
 
-    out.write(u'class BaseClient(object):\n\n')
-    out.write(u'    def __init__(self):\n')
-    for package in packages:
-        out.write(u'        self.%s = %s(self)\n' % (
-            package, package.capitalize())
-        )
-    out.write(u'\n\n')
-
     for package in packages:
 
         out.write(u'class %s(Package):\n\n' % package.capitalize())
@@ -141,9 +137,118 @@ def generate_code(specfile='api.json'):
                 call
             ))
             out.write(u'\n')
+
+    out.write(u'\nclass BaseClient(object):\n')
+    out.write(
+        u'    """\n'
+        u'    The packages are created on first access, so that clients (and\n'
+        u'    their session views) are cheap to create.\n'
+        u'\n'
+        u'    """\n\n'
+    )
+    for package in packages:
+        out.write(u'    %s = package_property(%s)\n' % (
+            package, package.capitalize())
+        )
+
+    out.write(u'\n\n'
+              u'#: Last.fm method => default cache TTL in seconds, or `None`\n'
+              u'#: if responses must not be cached (see cache_policy.json).\n')
+    out.write(u'CACHE_TTL = {\n')
+    for package in packages:
+        for method in sorted(spec[package].keys()):
+            name = '%s.%s' % (package, method)
+            out.write(u'    %r: %r,\n' % (
+                str(name), cache_ttl(name, spec[package][method], policy)))
+    out.write(u'}\n')
+
+    out.write(
+        u'\n\n'
+        u'#: Last.fm write method => {read method: parameters}. A successful\n'
+        u'#: call invalidates the cached responses of the read methods with\n'
+        u'#: the same values of the parameters'
+        u' (see cache_invalidation.json).\n'
+    )
+    out.write(u'CACHE_INVALIDATION = {\n')
+    for name in sorted(invalidation):
+        out.write(u'    %r: {\n' % str(name))
+        reads = invalidation[name]
+        for read in sorted(reads):
+            check_invalidation(spec, policy, name, read, reads[read])
+            out.write(u'        %r: %r,\n' % (
+                str(read), tuple(str(param) for param in reads[read])))
+        out.write(u'    },\n')
+    out.write(u'}\n')
+
+    out.write(
+        u'\n\n'
+        u'#: Last.fm method => {parameter: (key template, first index)}'
+        u' for the\n'
+        u'#: parameters taking several values in array notation.\n'
+    )
+    out.write(u'MULTIPLE_PARAMS = {\n')
+    for package in packages:
+        for method in sorted(spec[package].keys()):
+            params = spec[package][method]['params']
+            multiple = sorted(name for name in params
+                              if params[name]['multiple'])
+            if not multiple:
+                continue
+            out.write(u'    %r: {\n' % str('%s.%s' % (package, method)))
+            for name in multiple:
+                out.write(u'        %r: %r,\n' % (
+                    str(name), array_notation(name, params[name])))
+            out.write(u'    },\n')
+    out.write(u'}\n')
     print out.getvalue()
 
 
+def cache_ttl(name, spec, policy):
+    """
+    Return the cache TTL for the method as per the ``policy`` mapping
+    method name patterns to TTLs. The last matching pattern wins.
+    Methods needing authentication or other than ``GET`` are never cached.
+
+    """
+    if spec['auth'] or spec['http'] != 'GET':
+        return None
+    ttl = None
+    for pattern, pattern_ttl in policy.items():
+        if fnmatchcase(name, pattern):
+            ttl = pattern_ttl
+    return ttl
+
+
+def check_invalidation(spec, policy, write, read, params):
+    """
+    Make sure ``write`` and ``read`` are methods in the ``spec``, that
+    responses to ``read`` are cached, and that both take the ``params``.
+
+    """
+    def get_spec(name):
+        package, method = name.split('.')
+        return spec[package][method]
+
+    write_spec, read_spec = get_spec(write), get_spec(read)
+    assert write_spec['http'] != 'GET', write
+    assert cache_ttl(read, read_spec, policy) is not None, read
+    for param in params:
+        assert param in write_spec['params'], (write, param)
+        assert param in read_spec['params'], (read, param)
+
+
+def array_notation(name, spec):
+    """
+    Return the ``(key template, first index)`` for a parameter taking
+    several values: ``name1``, ``name2`` for those documented as
+    ``[1|2]``, ``name[0]``, ``name[1]``, ... for the others.
+
+    """
+    if spec['description'].startswith('[1|2]'):
+        return str(name + '%d'), 1
+    return str(name + '[%d]'), 0
+
+
 def prefix(text, p='    '):
     return '\n'.join((p + line) for line in text.splitlines())
 
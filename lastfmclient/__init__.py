@@ -1,6 +1,6 @@
 """
 Python client for the Last.fm API with a pythonic interface to all methods,
-including auth, etc. An async, Tornado-based client included as well.
+including auth, etc. Async clients for Tornado and asyncio included as well.
 
 """
 from .client import LastfmClient
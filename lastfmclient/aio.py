@@ -0,0 +1,339 @@
+"""
+Non-blocking Last.fm API client for asyncio (Python 3.5+).
+
+"""
+import asyncio
+import inspect
+
+from . import deadline
+from .client import LastfmClient
+from .compat import monotonic
+from .exceptions import LastfmError, NetworkError, TemporaryError
+from .transports import Transport, FORM_HEADERS
+
+
+class AiohttpTransport(Transport):
+    """
+    Non-blocking transport using ``aiohttp``.
+
+    Keep-alive connections are pooled by a single ``aiohttp.ClientSession``
+    owned by the transport.
+
+    """
+    def __init__(self, pool_maxsize=100, pool_maxsize_per_host=0,
+                 keepalive_timeout=15):
+        """
+        :param pool_maxsize: max. number of open connections
+        :param pool_maxsize_per_host: max. number of open connections
+                                      per host (``0`` for no limit)
+        :param keepalive_timeout: close connections idle for longer than
+                                  that many seconds, before the server
+                                  does so under our feet
+
+        """
+        try:
+            import aiohttp
+        except ImportError:
+            raise RuntimeError(
+                'You need to install aiohttp `pip install aiohttp` '
+                'to be able use the asyncio client.')
+        self._aiohttp = aiohttp
+        self.pool_maxsize = pool_maxsize
+        self.pool_maxsize_per_host = pool_maxsize_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+
+    @property
+    def session(self):
+        """The ``aiohttp.ClientSession`` owned by this transport."""
+        if self._session is None or self._session.closed:
+            connector = self._aiohttp.TCPConnector(
+                limit=self.pool_maxsize,
+                limit_per_host=self.pool_maxsize_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                enable_cleanup_closed=True,
+            )
+            self._session = self._aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def request(self, http_method, url, body=None, timeout=None):
+        headers = FORM_HEADERS if body is not None else None
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = self._aiohttp.ClientTimeout(total=timeout)
+        try:
+            async with self.session.request(http_method, url, data=body,
+                                            headers=headers,
+                                            **kwargs) as response:
+                return await response.read()
+        except (self._aiohttp.ClientConnectionError,
+                asyncio.TimeoutError) as e:
+            raise NetworkError(str(e) or type(e).__name__)
+
+    async def warmup(self, url, n=1):
+        """
+        Issue ``n`` concurrent ``HEAD`` requests to ``url``; their
+        connections are then kept in the pool.
+
+        """
+        n = min(n, self.pool_maxsize or n)
+
+        async def head():
+            async with self.session.head(url) as response:
+                await response.read()
+
+        await asyncio.gather(*[head() for _ in range(n)])
+        return n
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class HTTPXTransport(Transport):
+    """
+    Non-blocking transport using ``httpx``, optionally over HTTP/2.
+
+    With HTTP/2, concurrent calls are multiplexed over a single connection
+    instead of each needing its own, which suits fan-out workloads
+    (e.g., fetching all pages of a user's history at once). It requires
+    ``pip install httpx[http2]``. For ``https://`` API URLs, HTTP/2 is
+    negotiated via ALPN; for ``http://`` ones (such as a local stand-in
+    server), use ``prior_knowledge=True`` to speak HTTP/2 right away.
+
+    """
+    def __init__(self, http2=True, prior_knowledge=False, pool_maxsize=100,
+                 keepalive_timeout=15):
+        """
+        :param http2: enable HTTP/2
+        :param prior_knowledge: disable HTTP/1.1 altogether, and use
+                                HTTP/2 even over cleartext connections
+        :param pool_maxsize: max. number of open connections
+        :param keepalive_timeout: close connections idle for longer than
+                                  that many seconds
+
+        """
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError(
+                'You need to install httpx `pip install httpx[http2]` '
+                'to be able use this transport.')
+        self._httpx = httpx
+        self.http2 = http2
+        self.prior_knowledge = prior_knowledge
+        self.pool_maxsize = pool_maxsize
+        self.keepalive_timeout = keepalive_timeout
+        self._client = None
+
+    @property
+    def client(self):
+        """The ``httpx.AsyncClient`` owned by this transport."""
+        if self._client is None or self._client.is_closed:
+            limits = self._httpx.Limits(
+                max_connections=self.pool_maxsize,
+                keepalive_expiry=self.keepalive_timeout,
+            )
+            self._client = self._httpx.AsyncClient(
+                http1=not (self.http2 and self.prior_knowledge),
+                http2=self.http2,
+                limits=limits,
+                timeout=None,
+            )
+        return self._client
+
+    async def request(self, http_method, url, body=None, timeout=None):
+        headers = FORM_HEADERS if body is not None else None
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        try:
+            response = await self.client.request(
+                http_method, url, content=body, headers=headers, **kwargs)
+        except (self._httpx.TimeoutException,
+                self._httpx.NetworkError) as e:
+            raise NetworkError(str(e) or type(e).__name__)
+        return response.content
+
+    async def warmup(self, url, n=1):
+        """
+        Over HTTP/2, a single connection serves all the calls, so it is
+        opened with one ``HEAD`` request; otherwise see
+        `AiohttpTransport.warmup()`.
+
+        """
+        n = 1 if self.http2 else min(n, self.pool_maxsize or n)
+        await asyncio.gather(*[self.client.head(url) for _ in range(n)])
+        return n
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class AioLastfmClient(LastfmClient):
+    """
+    Non-blocking Last.fm API client for asyncio.
+
+    Uses ``aiohttp`` to perform HTTP requests by default (see
+    `AiohttpTransport`); pass ``transport=HTTPXTransport()`` for HTTP/2.
+    The number of calls in flight can be bounded, so that a single process
+    can keep thousands of calls going without exhausting sockets.
+
+    """
+    def __init__(self, api_key=None, api_secret=None, session_key=None,
+                 pool_maxsize=100, pool_maxsize_per_host=0,
+                 max_concurrency=None, transport=None, **kwargs):
+        """
+        :param pool_maxsize: max. number of open connections
+        :param pool_maxsize_per_host: max. number of open connections
+                                      per host (``0`` for no limit)
+        :param max_concurrency: max. number of calls in flight; further
+                                calls wait for a free slot (``None`` for
+                                no limit)
+        :param kwargs: passed to `LastfmClient`
+
+        """
+        self.pool_maxsize_per_host = pool_maxsize_per_host
+        super(AioLastfmClient, self).__init__(
+            api_key, api_secret, session_key,
+            pool_maxsize=pool_maxsize, transport=transport, **kwargs)
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        # Background tasks, referenced so that they are not collected.
+        self._tasks = set()
+
+    def _get_default_transport(self):
+        return AiohttpTransport(
+            pool_maxsize=self.pool_maxsize,
+            pool_maxsize_per_host=self.pool_maxsize_per_host,
+        )
+
+    @property
+    def semaphore(self):
+        if self._semaphore is None and self.max_concurrency:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def call(self, http_method, method, auth, params, session_key=None):
+        memoized = self._get_memoized(method, params)
+        if memoized is not None:
+            return memoized
+        url, body = self._get_request(
+            http_method, method, auth, params, session_key)
+        cache_key = self._get_cache_key(http_method, method, auth, url)
+        cached, stale = self._get_cached(cache_key)
+        if cached is not None and not stale:
+            return self._process_response_body(cached)
+
+        def fetch():
+            return self._fetch(http_method, method, url, body, cache_key)
+        if cached is not None:
+            return await self._serve_stale(cache_key, cached, fetch)
+        data = await fetch()
+        self._update_caches(method, params, data)
+        return data
+
+    async def _fetch(self, http_method, method, url, body, cache_key):
+        if self.coalesce and http_method == 'GET':
+            future = self._in_flight.get(url)
+            if future is None:
+                future = asyncio.ensure_future(
+                    self._limited_request(http_method, url, body))
+                self._in_flight[url] = future
+                future.add_done_callback(
+                    lambda _: self._in_flight.pop(url, None))
+            else:
+                # The leader caches the response.
+                cache_key = None
+            # A cancelled waiter must not cancel the others.
+            body = await asyncio.shield(future)
+        else:
+            body = await self._limited_request(http_method, url, body)
+        return self._process_response_body(
+            body, cache_key, self._get_cache_ttl(method))
+
+    async def _serve_stale(self, cache_key, cached, fetch):
+        if self.stale_while_revalidate:
+            self._revalidate(cache_key, fetch)
+            return self._process_response_body(cached)
+        try:
+            return await fetch()
+        except LastfmError as e:
+            if not isinstance(e, TemporaryError):
+                raise
+            return self._process_response_body(cached)
+
+    def _revalidate(self, cache_key, fetch):
+        if cache_key in self._revalidating:
+            return
+        self._revalidating.add(cache_key)
+
+        async def revalidate():
+            # Not bound by the caller's deadline.
+            deadline.set_current(None)
+            try:
+                await fetch()
+            except Exception:
+                pass
+            finally:
+                self._revalidating.discard(cache_key)
+        task = asyncio.ensure_future(revalidate())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _limited_request(self, http_method, url, body):
+        semaphore = self.semaphore
+        if semaphore is None:
+            return await self._request(http_method, url, body)
+        async with semaphore:
+            return await self._request(http_method, url, body)
+
+    async def _request(self, http_method, url, body):
+        timeout = self._get_timeout()
+
+        async def request():
+            response_body = self.transport.request(
+                http_method, url, body, timeout=timeout)
+            if inspect.isawaitable(response_body):
+                response_body = await response_body
+            return response_body
+        try:
+            if self.hedging is not None and http_method == 'GET':
+                return await self._hedge(request)
+            return await request()
+        except Exception:
+            self._check_deadline()
+            raise
+
+    async def _hedge(self, request):
+        """See `lastfmclient.hedging.hedge()`."""
+        policy = self.hedging
+        started = monotonic()
+        policy.start()
+        tasks = [asyncio.ensure_future(request())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=policy.delay())
+            if not done and policy.acquire():
+                tasks.append(asyncio.ensure_future(request()))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        policy.record(monotonic() - started)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def close(self):
+        """Close all pooled connections."""
+        closed = self.transport.close()
+        if inspect.isawaitable(closed):
+            await closed
@@ -1,26 +1,6 @@
 # Generated code. Do not edit.
-# 2014-06-06T16:24:16.858041Z
-from .package import Package
-
-
-class BaseClient(object):
-
-    def __init__(self):
-        self.album = Album(self)
-        self.artist = Artist(self)
-        self.auth = Auth(self)
-        self.chart = Chart(self)
-        self.event = Event(self)
-        self.geo = Geo(self)
-        self.group = Group(self)
-        self.library = Library(self)
-        self.playlist = Playlist(self)
-        self.radio = Radio(self)
-        self.tag = Tag(self)
-        self.tasteometer = Tasteometer(self)
-        self.track = Track(self)
-        self.user = User(self)
-        self.venue = Venue(self)
+# 2026-10-17T18:22:25.519989Z
+from .package import Package, package_property
 
 
 class Album(Package):
@@ -2751,3 +2731,308 @@ class Venue(Package):
         return self._call('GET', 'search', auth=False, venue=venue, country=country, limit=limit, page=page)
 
 
+class BaseClient(object):
+    """
+    The packages are created on first access, so that clients (and
+    their session views) are cheap to create.
+
+    """
+
+    album = package_property(Album)
+    artist = package_property(Artist)
+    auth = package_property(Auth)
+    chart = package_property(Chart)
+    event = package_property(Event)
+    geo = package_property(Geo)
+    group = package_property(Group)
+    library = package_property(Library)
+    playlist = package_property(Playlist)
+    radio = package_property(Radio)
+    tag = package_property(Tag)
+    tasteometer = package_property(Tasteometer)
+    track = package_property(Track)
+    user = package_property(User)
+    venue = package_property(Venue)
+
+
+#: Last.fm method => default cache TTL in seconds, or `None`
+#: if responses must not be cached (see cache_policy.json).
+CACHE_TTL = {
+    'album.addTags': None,
+    'album.getBuylinks': 3600,
+    'album.getInfo': 3600,
+    'album.getShouts': 300,
+    'album.getTags': 300,
+    'album.getTopTags': 3600,
+    'album.removeTag': None,
+    'album.search': 3600,
+    'album.share': None,
+    'artist.addTags': None,
+    'artist.getCorrection': 86400,
+    'artist.getEvents': 1800,
+    'artist.getInfo': 3600,
+    'artist.getPastEvents': 3600,
+    'artist.getPodcast': 3600,
+    'artist.getShouts': 300,
+    'artist.getSimilar': 3600,
+    'artist.getTags': 300,
+    'artist.getTopAlbums': 3600,
+    'artist.getTopFans': 3600,
+    'artist.getTopTags': 3600,
+    'artist.getTopTracks': 3600,
+    'artist.removeTag': None,
+    'artist.search': 3600,
+    'artist.share': None,
+    'artist.shout': None,
+    'auth.getMobileSession': None,
+    'auth.getSession': None,
+    'auth.getToken': None,
+    'chart.getHypedArtists': 10800,
+    'chart.getHypedTracks': 10800,
+    'chart.getLovedTracks': 10800,
+    'chart.getTopArtists': 10800,
+    'chart.getTopTags': 10800,
+    'chart.getTopTracks': 10800,
+    'event.attend': None,
+    'event.getAttendees': 1800,
+    'event.getInfo': 1800,
+    'event.getShouts': 300,
+    'event.share': None,
+    'event.shout': None,
+    'geo.getEvents': 1800,
+    'geo.getMetroArtistChart': 10800,
+    'geo.getMetroHypeArtistChart': 10800,
+    'geo.getMetroHypeTrackChart': 10800,
+    'geo.getMetroTrackChart': 10800,
+    'geo.getMetroUniqueArtistChart': 10800,
+    'geo.getMetroUniqueTrackChart': 10800,
+    'geo.getMetroWeeklyChartlist': 10800,
+    'geo.getMetros': 10800,
+    'geo.getTopArtists': 10800,
+    'geo.getTopTracks': 10800,
+    'group.getHype': 3600,
+    'group.getMembers': 3600,
+    'group.getWeeklyAlbumChart': 21600,
+    'group.getWeeklyArtistChart': 21600,
+    'group.getWeeklyChartList': 21600,
+    'group.getWeeklyTrackChart': 21600,
+    'library.addAlbum': None,
+    'library.addArtist': None,
+    'library.addTrack': None,
+    'library.getAlbums': 300,
+    'library.getArtists': 300,
+    'library.getTracks': 300,
+    'library.removeAlbum': None,
+    'library.removeArtist': None,
+    'library.removeScrobble': None,
+    'library.removeTrack': None,
+    'playlist.addTrack': None,
+    'playlist.create': None,
+    'radio.getPlaylist': None,
+    'radio.search': 3600,
+    'radio.tune': None,
+    'tag.getInfo': 10800,
+    'tag.getSimilar': 10800,
+    'tag.getTopAlbums': 10800,
+    'tag.getTopArtists': 10800,
+    'tag.getTopTags': 10800,
+    'tag.getTopTracks': 10800,
+    'tag.getWeeklyArtistChart': 10800,
+    'tag.getWeeklyChartList': 10800,
+    'tag.search': 3600,
+    'tasteometer.compare': 3600,
+    'tasteometer.compareGroup': 3600,
+    'track.addTags': None,
+    'track.ban': None,
+    'track.getBuylinks': 3600,
+    'track.getCorrection': 86400,
+    'track.getFingerprintMetadata': 86400,
+    'track.getInfo': 3600,
+    'track.getShouts': 300,
+    'track.getSimilar': 3600,
+    'track.getTags': 300,
+    'track.getTopFans': 3600,
+    'track.getTopTags': 3600,
+    'track.love': None,
+    'track.removeTag': None,
+    'track.scrobble': None,
+    'track.search': 3600,
+    'track.share': None,
+    'track.unban': None,
+    'track.unlove': None,
+    'track.updateNowPlaying': None,
+    'user.getArtistTracks': 60,
+    'user.getBannedTracks': 60,
+    'user.getEvents': 1800,
+    'user.getFriends': 300,
+    'user.getInfo': 30,
+    'user.getLovedTracks': 60,
+    'user.getNeighbours': 300,
+    'user.getNewReleases': 300,
+    'user.getPastEvents': 300,
+    'user.getPersonalTags': 300,
+    'user.getPlaylists': 300,
+    'user.getRecentStations': None,
+    'user.getRecentTracks': 10,
+    'user.getRecommendedArtists': None,
+    'user.getRecommendedEvents': None,
+    'user.getShouts': 300,
+    'user.getTopAlbums': 3600,
+    'user.getTopArtists': 3600,
+    'user.getTopTags': 3600,
+    'user.getTopTracks': 3600,
+    'user.getWeeklyAlbumChart': 3600,
+    'user.getWeeklyArtistChart': 3600,
+    'user.getWeeklyChartList': 3600,
+    'user.getWeeklyTrackChart': 3600,
+    'user.shout': None,
+    'user.signUp': None,
+    'user.terms': None,
+    'venue.getEvents': 1800,
+    'venue.getPastEvents': 3600,
+    'venue.search': 3600,
+}
+
+
+#: Last.fm write method => {read method: parameters}. A successful
+#: call invalidates the cached responses of the read methods with
+#: the same values of the parameters (see cache_invalidation.json).
+CACHE_INVALIDATION = {
+    'album.addTags': {
+        'album.getInfo': ('artist', 'album'),
+        'album.getTags': ('artist', 'album'),
+        'user.getPersonalTags': (),
+        'user.getTopTags': (),
+    },
+    'album.removeTag': {
+        'album.getInfo': ('artist', 'album'),
+        'album.getTags': ('artist', 'album'),
+        'user.getPersonalTags': (),
+        'user.getTopTags': (),
+    },
+    'artist.addTags': {
+        'artist.getInfo': ('artist',),
+        'artist.getTags': ('artist',),
+        'user.getPersonalTags': (),
+        'user.getTopTags': (),
+    },
+    'artist.removeTag': {
+        'artist.getInfo': ('artist',),
+        'artist.getTags': ('artist',),
+        'user.getPersonalTags': (),
+        'user.getTopTags': (),
+    },
+    'artist.shout': {
+        'artist.getShouts': ('artist',),
+    },
+    'event.attend': {
+        'event.getAttendees': ('event',),
+        'user.getEvents': (),
+    },
+    'event.shout': {
+        'event.getShouts': ('event',),
+    },
+    'library.addAlbum': {
+        'library.getAlbums': ('artist',),
+        'library.getArtists': (),
+        'library.getTracks': ('artist', 'album'),
+    },
+    'library.addArtist': {
+        'library.getArtists': (),
+    },
+    'library.addTrack': {
+        'library.getArtists': (),
+        'library.getTracks': ('artist',),
+    },
+    'library.removeAlbum': {
+        'library.getAlbums': ('artist',),
+        'library.getArtists': (),
+        'library.getTracks': ('artist', 'album'),
+    },
+    'library.removeArtist': {
+        'library.getAlbums': ('artist',),
+        'library.getArtists': (),
+        'library.getTracks': ('artist',),
+    },
+    'library.removeScrobble': {
+        'library.getTracks': ('artist',),
+        'user.getArtistTracks': ('artist',),
+        'user.getRecentTracks': (),
+    },
+    'library.removeTrack': {
+        'library.getArtists': (),
+        'library.getTracks': ('artist',),
+    },
+    'playlist.addTrack': {
+        'user.getPlaylists': (),
+    },
+    'playlist.create': {
+        'user.getPlaylists': (),
+    },
+    'track.addTags': {
+        'track.getInfo': ('artist', 'track'),
+        'track.getTags': ('artist', 'track'),
+        'user.getPersonalTags': (),
+        'user.getTopTags': (),
+    },
+    'track.ban': {
+        'user.getBannedTracks': (),
+    },
+    'track.love': {
+        'track.getInfo': ('artist', 'track'),
+        'user.getLovedTracks': (),
+    },
+    'track.removeTag': {
+        'track.getInfo': ('artist', 'track'),
+        'track.getTags': ('artist', 'track'),
+        'user.getPersonalTags': (),
+        'user.getTopTags': (),
+    },
+    'track.scrobble': {
+        'user.getArtistTracks': ('artist',),
+        'user.getRecentTracks': (),
+    },
+    'track.unban': {
+        'user.getBannedTracks': (),
+    },
+    'track.unlove': {
+        'track.getInfo': ('artist', 'track'),
+        'user.getLovedTracks': (),
+    },
+    'track.updateNowPlaying': {
+        'user.getRecentTracks': (),
+    },
+    'user.shout': {
+        'user.getShouts': ('user',),
+    },
+}
+
+
+#: Last.fm method => {parameter: (key template, first index)} for the
+#: parameters taking several values in array notation.
+MULTIPLE_PARAMS = {
+    'library.addAlbum': {
+        'album': ('album[%d]', 0),
+        'artist': ('artist[%d]', 0),
+    },
+    'library.addArtist': {
+        'artist': ('artist[%d]', 0),
+    },
+    'tasteometer.compare': {
+        'type': ('type%d', 1),
+        'value': ('value%d', 1),
+    },
+    'track.scrobble': {
+        'album': ('album[%d]', 0),
+        'albumArtist': ('albumArtist[%d]', 0),
+        'artist': ('artist[%d]', 0),
+        'chosenByUser': ('chosenByUser[%d]', 0),
+        'context': ('context[%d]', 0),
+        'duration': ('duration[%d]', 0),
+        'mbid': ('mbid[%d]', 0),
+        'streamId': ('streamId[%d]', 0),
+        'timestamp': ('timestamp[%d]', 0),
+        'track': ('track[%d]', 0),
+        'trackNumber': ('trackNumber[%d]', 0),
+    },
+}
@@ -1,45 +1,320 @@
-import json
-from urllib import urlencode
+import socket
+import weakref
+from datetime import timedelta
 
-from tornado.gen import coroutine, Return
-from tornado.httpclient import AsyncHTTPClient
+from tornado.gen import (
+    coroutine, maybe_future, with_timeout, Return, TimeoutError,
+    WaitIterator)
+from tornado.httpclient import AsyncHTTPClient, HTTPError
+from tornado.ioloop import IOLoop
 
-from .client import LastfmClient, API_URL
+from . import deadline
+from .client import LastfmClient
+from .compat import monotonic
+from .exceptions import LastfmError, NetworkError, TemporaryError
+from .transports import Transport, FORM_HEADERS
 
 
-class AsyncLastfmClient(LastfmClient):
+HTTP_CLIENT_IMPLS = {
+    'simple': 'tornado.simple_httpclient.SimpleAsyncHTTPClient',
+    'curl': 'tornado.curl_httpclient.CurlAsyncHTTPClient',
+}
+
+# IOLoop => {config: AsyncHTTPClient}
+_shared_http_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_client(impl=None, max_clients=10, max_host_clients=None,
+                    keep_alive=True):
     """
-    Non-blocking Last.fm API client for Tornado.
+    Return an ``AsyncHTTPClient`` for the current ``IOLoop`` configured for
+    talking to the API. Clients with the same configuration are shared.
 
-    Uses ``tornado.httpclient.AsyncHTTPClient`` to perform HTTP requests.
+    :param impl: ``'simple'``, ``'curl'``, or an ``AsyncHTTPClient``
+                 subclass; ``None`` means the globally configured one
+    :param max_clients: max. number of concurrent requests; any further
+                        requests are queued
+    :param max_host_clients: max. number of connections per host
+                             (only honoured by ``curl``)
+    :param keep_alive: keep connections open between requests
+                       (only honoured by ``curl``; the simple client
+                       always closes them)
 
     """
-    def __init__(self, api_key=None, api_secret=None, session_key=None):
-        super(AsyncLastfmClient, self).__init__(
-            api_key, api_secret, session_key)
+    config = (impl, max_clients, max_host_clients, keep_alive)
+    clients = _shared_http_clients.setdefault(IOLoop.current(), {})
+    if config not in clients:
+        clients[config] = _create_http_client(*config)
+    return clients[config]
+
+
+def _create_http_client(impl, max_clients, max_host_clients, keep_alive):
+    if impl is None:
+        cls = AsyncHTTPClient
+    elif isinstance(impl, type):
+        cls = impl
+    else:
+        module, name = HTTP_CLIENT_IMPLS[impl].rsplit('.', 1)
+        cls = getattr(__import__(module, fromlist=[name]), name)
+    client = cls(force_instance=True, max_clients=max_clients)
+
+    multi = getattr(client, '_multi', None)
+    if multi is not None:
+        # ``curl``: tune the connection cache of the multi handle.
+        import pycurl
+        if max_host_clients:
+            multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS, max_host_clients)
+        multi.setopt(pycurl.M_MAXCONNECTS, max_clients if keep_alive else 0)
+    return client
+
+
+class TornadoTransport(Transport):
+    """
+    Non-blocking transport using ``tornado.httpclient.AsyncHTTPClient``.
+
+    """
+    def __init__(self, http_client=None, impl=None, max_clients=10,
+                 max_host_clients=None, keep_alive=True,
+                 connect_timeout=None, request_timeout=None):
+        """
+        :param http_client: an ``AsyncHTTPClient`` instance to use; if not
+                            provided, a shared one is obtained via
+                            `get_http_client()` with the ``impl``,
+                            ``max_clients``, ``max_host_clients``, and
+                            ``keep_alive`` arguments
+        :param connect_timeout: timeout for the initial connection, in
+                                seconds
+        :param request_timeout: timeout for the whole request, in seconds
+
+        """
         if not AsyncHTTPClient:
             raise RuntimeError(
                 'You need to install Tornado to be able use the async client.')
-        self._async_client = AsyncHTTPClient()
+        self.http_client = http_client or get_http_client(
+            impl=impl,
+            max_clients=max_clients,
+            max_host_clients=max_host_clients,
+            keep_alive=keep_alive,
+        )
+        self.fetch_options = {}
+        if connect_timeout is not None:
+            self.fetch_options['connect_timeout'] = connect_timeout
+        if request_timeout is not None:
+            self.fetch_options['request_timeout'] = request_timeout
 
     @coroutine
-    def call(self, http_method, method, auth, params):
+    def request(self, http_method, url, body=None, timeout=None):
+        headers = FORM_HEADERS if body is not None else None
+        options = self.fetch_options
+        if timeout is not None:
+            options = dict(options, request_timeout=timeout)
+        try:
+            response = yield self.http_client.fetch(url,
+                                                    method=http_method,
+                                                    body=body,
+                                                    headers=headers,
+                                                    **options)
+        except HTTPError as e:
+            if e.code != 599:
+                raise
+            # Timeout or network error.
+            raise NetworkError(str(e))
+        except socket.error as e:
+            raise NetworkError(str(e))
+        if response.error is not None:
+            response.rethrow()
+        raise Return(response.body)
+
+    @coroutine
+    def warmup(self, url, n=1):
+        """
+        Issue ``n`` concurrent ``HEAD`` requests to ``url`` so that their
+        connections stay cached. Only ``curl`` keeps connections alive,
+        so this is a no-op with the other implementations.
+
+        """
+        if not hasattr(self.http_client, '_multi'):
+            raise Return(0)
+        n = min(n, self.http_client.max_clients)
+        yield [self.http_client.fetch(url, method='HEAD', raise_error=False,
+                                      **self.fetch_options)
+               for _ in range(n)]
+        raise Return(n)
 
-        url = API_URL
+    @property
+    def queue_depth(self):
+        """The number of requests waiting for a free ``max_clients`` slot."""
+        return self.pool_stats()['queued']
 
-        params = self._get_params(method, params, auth)
-        params = urlencode({k: unicode(v).encode('utf8')
-                            for k, v in params.items()})
-        if http_method == 'POST':
-            body = params
+    def pool_stats(self):
+        """
+        Return a `dict` with the HTTP client's counters:
+
+        ``active``: requests being processed
+        ``queued``: requests waiting for a free slot
+        ``max_clients``: max. number of concurrent requests
+
+        """
+        client = self.http_client
+        max_clients = getattr(client, 'max_clients', None)
+        if hasattr(client, '_free_list'):
+            # ``curl``
+            queued = len(client._requests)
+            active = len(client._curls) - len(client._free_list)
         else:
-            body = None
-            url = url + '?' + params
+            queued = len(getattr(client, 'queue', ()))
+            active = len(getattr(client, 'active', ()))
+        return {
+            'active': active,
+            'queued': queued,
+            'max_clients': max_clients,
+        }
 
-        response = yield self._async_client.fetch(url,
-                                                  method=http_method,
-                                                  body=body)
-        if response.error is not None:
-            response.rethrow()
-        data = self._process_response_data(json.loads(response.body))
+
+class AsyncLastfmClient(LastfmClient):
+    """
+    Non-blocking Last.fm API client for Tornado.
+
+    Uses ``tornado.httpclient.AsyncHTTPClient`` to perform HTTP requests
+    by default (see `TornadoTransport`). Clients created with the same
+    HTTP options share one ``AsyncHTTPClient`` per ``IOLoop``.
+
+    """
+    #: `TornadoTransport` arguments accepted by the constructor.
+    HTTP_OPTIONS = ('http_client', 'impl', 'max_clients', 'max_host_clients',
+                    'keep_alive', 'connect_timeout', 'request_timeout')
+
+    def __init__(self, api_key=None, api_secret=None, session_key=None,
+                 transport=None, **kwargs):
+        """
+        :param kwargs: `TornadoTransport` arguments, used when no
+                       ``transport`` is given (see ``HTTP_OPTIONS``), and
+                       `LastfmClient` arguments
+
+        """
+        self.http_options = {name: kwargs.pop(name)
+                             for name in self.HTTP_OPTIONS if name in kwargs}
+        super(AsyncLastfmClient, self).__init__(
+            api_key, api_secret, session_key, transport=transport, **kwargs)
+
+    def _get_default_transport(self):
+        return TornadoTransport(**self.http_options)
+
+    @property
+    def queue_depth(self):
+        """See `TornadoTransport.queue_depth`."""
+        return self.transport.pool_stats().get('queued', 0)
+
+    @coroutine
+    def call(self, http_method, method, auth, params, session_key=None):
+        memoized = self._get_memoized(method, params)
+        if memoized is not None:
+            raise Return(memoized)
+        url, body = self._get_request(
+            http_method, method, auth, params, session_key)
+        cache_key = self._get_cache_key(http_method, method, auth, url)
+        cached, stale = self._get_cached(cache_key)
+        if cached is not None and not stale:
+            raise Return(self._process_response_body(cached))
+
+        def fetch():
+            return self._fetch(http_method, method, url, body, cache_key)
+        if cached is not None:
+            data = yield self._serve_stale(cache_key, cached, fetch)
+        else:
+            data = yield fetch()
+            self._update_caches(method, params, data)
         raise Return(data)
+
+    @coroutine
+    def _fetch(self, http_method, method, url, body, cache_key):
+        timeout = self._get_timeout()
+
+        def request():
+            return maybe_future(self.transport.request(
+                http_method, url, body, timeout=timeout))
+
+        def fetch():
+            if self.hedging is not None and http_method == 'GET':
+                return self._hedge(request)
+            return request()
+        try:
+            if self.coalesce and http_method == 'GET':
+                future = self._in_flight.get(url)
+                if future is None:
+                    future = self._in_flight[url] = fetch()
+                    future.add_done_callback(
+                        lambda _: self._in_flight.pop(url, None))
+                else:
+                    # The leader caches the response.
+                    cache_key = None
+                body = yield future
+            else:
+                body = yield fetch()
+        except Exception:
+            self._check_deadline()
+            raise
+        raise Return(self._process_response_body(
+            body, cache_key, self._get_cache_ttl(method)))
+
+    @coroutine
+    def _serve_stale(self, cache_key, cached, fetch):
+        if self.stale_while_revalidate:
+            self._revalidate(cache_key, fetch)
+            raise Return(self._process_response_body(cached))
+        try:
+            data = yield fetch()
+        except LastfmError as e:
+            if not isinstance(e, TemporaryError):
+                raise
+            data = self._process_response_body(cached)
+        raise Return(data)
+
+    def _revalidate(self, cache_key, fetch):
+        if cache_key in self._revalidating:
+            return
+        self._revalidating.add(cache_key)
+
+        @coroutine
+        def revalidate():
+            # Not bound by the caller's deadline.
+            deadline.set_current(None)
+            try:
+                yield fetch()
+            except Exception:
+                pass
+            finally:
+                self._revalidating.discard(cache_key)
+        IOLoop.current().spawn_callback(revalidate)
+
+    @coroutine
+    def _hedge(self, request):
+        """
+        See `lastfmclient.hedging.hedge()`. Tornado's HTTP clients
+        cannot cancel requests, so the losing one is only ignored.
+
+        """
+        policy = self.hedging
+        started = monotonic()
+        policy.start()
+        primary = request()
+        try:
+            result = yield with_timeout(
+                timedelta(seconds=policy.delay()), primary,
+                quiet_exceptions=(Exception,))
+        except TimeoutError:
+            if not policy.acquire():
+                result = yield primary
+            else:
+                error = None
+                waiter = WaitIterator(primary, request())
+                while not waiter.done():
+                    try:
+                        result = yield waiter.next()
+                        break
+                    except Exception as e:
+                        error = error or e
+                else:
+                    raise error
+        policy.record(monotonic() - started)
+        raise Return(result)
@@ -0,0 +1,636 @@
+"""
+Response caches.
+
+Clients created with a ``cache`` keep the raw response bodies of
+successful unauthenticated ``GET`` calls in it. Entries are keyed on the
+canonical (sorted and encoded) request parameters, so identical calls hit
+the same entry.
+
+Caches created with a ``stale_ttl`` keep entries for that long past their
+expiry. Such stale entries are served when a refresh fails with a temporary
+error (e.g., the service being offline), or right away while they are
+refreshed in the background if the client has
+``stale_while_revalidate=True``.
+
+Caches created with a ``negative_ttl`` also keep the error responses caused
+by the request itself (`NEGATIVE_ERRORS`, e.g., for a misspelled artist
+name) for that long, so that repeating the call raises the same error
+without a round trip.
+
+Clients created with ``normalize_names=True`` normalize the artist, album
+and track names in cache keys (see `normalize_name()`), so that calls
+differing only in, e.g., letter case share entries. A `CorrectionMemo`
+additionally remembers the results of ``artist.getCorrection`` and
+``track.getCorrection``.
+
+`MemoryCache` can be given a `TinyLFU` admission policy, which keeps
+one-off responses (e.g., from a bulk scan of rarely requested artists)
+from evicting frequently requested ones.
+
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from array import array
+from collections import OrderedDict
+
+from .compat import text_type
+from .exceptions import InvalidParametersError, InvalidResourceError
+from .transports import encode_params
+from .utils import Periodic
+
+
+#: The TTL of entries set without one in caches without a ``ttl``.
+DEFAULT_TTL = 300
+
+#: Errors cached for ``negative_ttl``.
+NEGATIVE_ERRORS = (InvalidParametersError, InvalidResourceError)
+
+#: Parameters holding names, which Last.fm matches regardless of case.
+NAME_PARAMS = ('artist', 'album', 'track')
+
+#: Methods whose results `CorrectionMemo` remembers.
+CORRECTION_METHODS = ('artist.getCorrection', 'track.getCorrection')
+
+#: ``PRAGMA auto_vacuum`` value for incremental vacuum.
+INCREMENTAL = 2
+
+METHOD_RE = re.compile(r'(?:^|&)method=([^&]*)')
+
+
+class Cache(object):
+    """Base cache class."""
+
+    def __init__(self, ttl=None, stale_ttl=0, negative_ttl=0):
+        """
+        :param ttl: the number of seconds entries are fresh for; if set,
+                    it overrides the clients' per-method defaults
+                    (`lastfmclient.api.CACHE_TTL`), but not their
+                    ``cache_ttl`` argument; if ``None``, the defaults
+                    apply, and `DEFAULT_TTL` to entries set without one
+        :param stale_ttl: the number of seconds expired entries are kept
+                          for, to be served stale
+        :param negative_ttl: the number of seconds `NEGATIVE_ERRORS`
+                             responses are fresh for (``0`` not to cache
+                             them)
+
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        # Last.fm method => {outcome: count}
+        self._method_stats = {}
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        """Return the fresh body cached under ``key``, or ``None``."""
+        body, stale = self.lookup(key)
+        return None if stale else body
+
+    def lookup(self, key):
+        """
+        Return ``(body, stale)`` for the entry cached under ``key``, where
+        ``stale`` is ``True`` if it has expired, or ``(None, False)``.
+
+        """
+        raise NotImplementedError
+
+    def set(self, key, body, ttl=None):
+        """
+        Cache ``body`` under ``key`` for ``ttl`` seconds (the cache's
+        ``ttl`` or `DEFAULT_TTL` if ``None``).
+
+        """
+        raise NotImplementedError
+
+    def invalidate(self, params):
+        """
+        Drop the entries for requests with the given parameter values, or
+        without some of the parameters at all, and return their number::
+
+            cache.invalidate({'method': 'track.getInfo',
+                              'artist': 'Cher', 'track': 'Believe'})
+
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {'hits': self.hits, 'stale_hits': self.stale_hits,
+                'misses': self.misses}
+
+    def method_stats(self):
+        """
+        Return a `dict` mapping Last.fm method names to their lookup
+        counters and hit ratio (stale hits included).
+
+        """
+        with self._stats_lock:
+            method_stats = {method: dict(counts) for method, counts
+                            in self._method_stats.items()}
+        stats = {}
+        for method, counts in method_stats.items():
+            total = sum(counts.values())
+            hits = counts['hits'] + counts['stale_hits']
+            counts['hit_ratio'] = float(hits) / total if total else 0.0
+            stats[method] = counts
+        return stats
+
+    def _record(self, key, outcome):
+        """
+        Count a lookup of ``key`` with ``outcome`` (``'hits'``,
+        ``'stale_hits'`` or ``'misses'``).
+
+        """
+        match = METHOD_RE.search(key)
+        method = match.group(1) if match else None
+        with self._stats_lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            counts = self._method_stats.get(method)
+            if counts is None:
+                counts = self._method_stats[method] = {
+                    'hits': 0, 'stale_hits': 0, 'misses': 0}
+            counts[outcome] += 1
+
+
+class MemoryCache(Cache):
+    """
+    In-process LRU cache with TTL expiry, bounded by the number of entries
+    as well as their total size. It is thread-safe.
+
+    With an ``admission`` policy, a new entry that would evict the least
+    recently used one is only cached if its key is estimated to be looked
+    up more frequently.
+
+    """
+
+    def __init__(self, ttl=None, max_entries=10000, max_bytes=64 * 1024 ** 2,
+                 stale_ttl=0, negative_ttl=0, admission=None):
+        """
+        :param max_entries: the max. number of entries
+        :param max_bytes: the max. total size of the cached bodies, in
+                          bytes when encoded as UTF-8
+        :param admission: a `TinyLFU` instance, or ``True`` for one sized
+                          for ``max_entries``
+
+        """
+        super(MemoryCache, self).__init__(ttl, stale_ttl, negative_ttl)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        if admission is True:
+            admission = TinyLFU(max_entries)
+        self.admission = admission
+        self.rejections = 0
+        self.size = 0
+        # key => (expires, body, size), least recently used first.
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key):
+        with self._lock:
+            if self.admission is not None:
+                self.admission.record(key)
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._record(key, 'misses')
+                return None, False
+            expires, body, size = entry
+            now = time.time()
+            if expires + self.stale_ttl < now:
+                self.size -= size
+                self._record(key, 'misses')
+                return None, False
+            # Mark as most recently used.
+            self._entries[key] = entry
+            if expires < now:
+                self._record(key, 'stale_hits')
+                return body, True
+            self._record(key, 'hits')
+            return body, False
+
+    def set(self, key, body, ttl=None):
+        if ttl is None:
+            ttl = DEFAULT_TTL if self.ttl is None else self.ttl
+        size = len(body.encode('utf8') if isinstance(body, text_type)
+                   else body)
+        now = time.time()
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            if size > self.max_bytes:
+                # The old body, if any, is outdated all the same.
+                return
+            if old is None and not self._admit(key, size, now):
+                self.rejections += 1
+                return
+            self._entries[key] = (now + ttl, body, size)
+            self.size += size
+            while (len(self._entries) > self.max_entries
+                   or self.size > self.max_bytes):
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    def _admit(self, key, size, now):
+        """
+        Return ``True`` if a new entry for ``key`` should be cached, given
+        the least recently used one it would evict, if any.
+
+        """
+        if self.admission is None or not self._entries:
+            return True
+        if (len(self._entries) < self.max_entries
+                and self.size + size <= self.max_bytes):
+            return True
+        victim = next(iter(self._entries))
+        expires = self._entries[victim][0]
+        if expires + self.stale_ttl < now:
+            return True
+        return self.admission.admit(key, victim)
+
+    def invalidate(self, params):
+        terms = _get_terms(params)
+        with self._lock:
+            keys = [key for key in self._entries if _matches(key, terms)]
+            for key in keys:
+                self.size -= self._entries.pop(key)[2]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        stats = super(MemoryCache, self).stats()
+        stats.update(entries=len(self._entries), bytes=self.size,
+                     rejections=self.rejections)
+        return stats
+
+
+class SQLiteCache(Cache):
+    """
+    On-disk cache in an SQLite database that can be shared by several
+    processes (and threads), and survives restarts.
+
+    Expired entries (past their ``stale_ttl``) are removed, and the least
+    recently used ones evicted to fit in ``max_bytes``, by `compact()`. It
+    can be run periodically in a background thread, so ``max_bytes`` may
+    be exceeded until the next compaction.
+
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            body BLOB NOT NULL,
+            compressed INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            expires REAL NOT NULL,
+            accessed REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_expires
+            ON responses (expires);
+        CREATE INDEX IF NOT EXISTS responses_accessed
+            ON responses (accessed);
+    """
+
+    #: Access times are only updated when older than that many seconds,
+    #: so that most reads don't need to write.
+    ACCESS_RESOLUTION = 60
+
+    def __init__(self, path, ttl=None, max_bytes=256 * 1024 ** 2,
+                 compress=False, compress_min_size=1024,
+                 compact_interval=None, timeout=10, stale_ttl=0,
+                 negative_ttl=0):
+        """
+        :param path: path to the database file
+        :param max_bytes: the max. total size of the stored bodies
+        :param compress: compress bodies with ``zlib``
+        :param compress_min_size: don't compress bodies smaller than that
+        :param compact_interval: if set, run `compact()` every that many
+                                 seconds in a background thread
+        :param timeout: how long to wait for a lock held by another
+                        process, in seconds
+
+        """
+        super(SQLiteCache, self).__init__(ttl, stale_ttl, negative_ttl)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.compress_min_size = compress_min_size
+        self.timeout = timeout
+        self._local = threading.local()
+        db = self._connection
+        with db:
+            db.executescript(self.SCHEMA)
+        if db.execute('PRAGMA auto_vacuum').fetchone()[0] != INCREMENTAL:
+            # Created by a version that didn't enable it early enough.
+            db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            db.execute('VACUUM')
+        self._compactor = None
+        if compact_interval:
+            self._compactor = Periodic(self.compact, compact_interval,
+                                       name='lastfmclient-cache-compactor')
+
+    @property
+    def _connection(self):
+        """The database connection of the current thread."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            # Only takes effect on a new database, and must precede the
+            # switch to WAL as well as the creation of tables.
+            db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = NORMAL')
+            self._local.db = db
+        return db
+
+    def lookup(self, key):
+        db = self._connection
+        row = db.execute(
+            'SELECT body, compressed, expires, accessed FROM responses'
+            ' WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row is None or row[2] + self.stale_ttl < now:
+            self._record(key, 'misses')
+            return None, False
+        body, compressed, expires, accessed = row
+        if accessed < now - self.ACCESS_RESOLUTION:
+            with db:
+                db.execute('UPDATE responses SET accessed = ? WHERE key = ?',
+                           (now, key))
+        stale = expires < now
+        self._record(key, 'stale_hits' if stale else 'hits')
+        body = bytes(body)
+        if compressed:
+            body = zlib.decompress(body)
+        return body.decode('utf8'), stale
+
+    def set(self, key, body, ttl=None):
+        if ttl is None:
+            ttl = DEFAULT_TTL if self.ttl is None else self.ttl
+        if not isinstance(body, bytes):
+            body = body.encode('utf8')
+        compressed = self.compress and len(body) >= self.compress_min_size
+        if compressed:
+            body = zlib.compress(body)
+        if len(body) > self.max_bytes:
+            return
+        now = time.time()
+        with self._connection as db:
+            db.execute(
+                'INSERT OR REPLACE INTO responses'
+                ' (key, body, compressed, size, expires, accessed)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (key, sqlite3.Binary(body), int(compressed), len(body),
+                 now + ttl, now))
+
+    def compact(self):
+        """
+        Delete expired entries, evict the least recently used ones beyond
+        ``max_bytes``, and release the freed space.
+
+        """
+        db = self._connection
+        with db:
+            db.execute('DELETE FROM responses WHERE expires < ?',
+                       (time.time() - self.stale_ttl,))
+            total = db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            excess = total - self.max_bytes
+            if excess > 0:
+                # Find the access time up to which the least recently used
+                # entries cover the excess, and delete them.
+                rows = db.execute(
+                    'SELECT accessed, size FROM responses ORDER BY accessed')
+                for cutoff, size in rows:
+                    excess -= size
+                    if excess <= 0:
+                        break
+                db.execute('DELETE FROM responses WHERE accessed <= ?',
+                           (cutoff,))
+        # Frees a page per step, and `execute()` only takes the first one.
+        db.executescript('PRAGMA incremental_vacuum;')
+        db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def invalidate(self, params):
+        where, args = [], []
+        for name, pair in _get_terms(params):
+            where.append("(instr('&' || key || '&', ?)"
+                         " OR NOT instr('&' || key || '&', ?))")
+            args.extend([pair, name])
+        with self._connection as db:
+            return db.execute('DELETE FROM responses WHERE ' +
+                              ' AND '.join(where), args).rowcount
+
+    def clear(self):
+        with self._connection as db:
+            db.execute('DELETE FROM responses')
+
+    def stats(self):
+        stats = super(SQLiteCache, self).stats()
+        entries, size = self._connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses'
+        ).fetchone()
+        stats.update(entries=entries, bytes=size)
+        return stats
+
+    def close(self):
+        if self._compactor is not None:
+            self._compactor.stop()
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+def _get_terms(params):
+    """
+    Return ``(&name=, &name=value&)`` pairs of substrings of ``&``-enclosed
+    cache keys matching ``params``.
+
+    """
+    return [('&%s=' % name, '&%s&' % encode_params({name: value}))
+            for name, value in params.items()]
+
+
+def _matches(key, terms):
+    key = '&' + key + '&'
+    return all(pair in key or name not in key for name, pair in terms)
+
+
+class TinyLFU(object):
+    """
+    TinyLFU admission policy: the lookup frequencies of keys are
+    estimated by a count-min sketch, whose counters are all halved every
+    ``sample_size`` lookups, so that the estimates reflect recent traffic.
+    A new entry is only admitted if its key is more frequent than that of
+    the entry it would evict. Keys looked up once, as by a scan, are thus
+    never admitted in place of popular ones.
+
+    """
+
+    #: Counters saturate at this value (the sketch needs only 4 bits).
+    MAX_COUNT = 15
+
+    def __init__(self, width=10000, depth=4, sample_size=None):
+        """
+        :param width: the number of counters in each row of the sketch,
+                      which should be about the number of cache entries
+        :param depth: the number of rows (hash functions)
+        :param sample_size: the number of lookups after which the counters
+                            are halved (``10 * width`` by default)
+
+        """
+        self.width = width
+        self.depth = depth
+        self.sample_size = sample_size or 10 * width
+        self._rows = [array('B', [0]) * width for _ in range(depth)]
+        self._additions = 0
+
+    def _indexes(self, key):
+        # Derive ``depth`` hashes from one (Kirsch and Mitzenmacher).
+        h = hash(key)
+        h1, h2 = h & 0xffffffff, (h >> 32) & 0xffffffff | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def record(self, key):
+        """Count a lookup of ``key``."""
+        for row, i in zip(self._rows, self._indexes(key)):
+            if row[i] < self.MAX_COUNT:
+                row[i] += 1
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._age()
+
+    def estimate(self, key):
+        """Return the estimated recent number of lookups of ``key``."""
+        return min(row[i] for row, i in zip(self._rows, self._indexes(key)))
+
+    def admit(self, candidate, victim):
+        """
+        Return ``True`` if the ``candidate`` key should be cached in place
+        of the ``victim`` one.
+
+        """
+        return self.estimate(candidate) > self.estimate(victim)
+
+    def _age(self):
+        for row in self._rows:
+            for i, count in enumerate(row):
+                if count:
+                    row[i] = count >> 1
+        self._additions //= 2
+
+
+class CorrectionMemo(object):
+    """
+    Persistent memo of the results of ``artist.getCorrection`` and
+    ``track.getCorrection``, keyed on the normalized names, so that the
+    name variants seen once are never looked up again.
+
+    It also maps the variants to the canonical names, which clients with
+    ``normalize_names=True`` use in the cache keys of calls made with
+    ``autocorrect=1``, as their responses are those for the canonical
+    names.
+
+    """
+
+    def __init__(self, path, ttl=30 * 24 * 3600):
+        """
+        :param path: path to the database file, which can be shared with
+                     a `SQLiteCache`
+        :param ttl: the number of seconds results are kept for
+
+        """
+        self._store = SQLiteCache(path, ttl=ttl)
+
+    def get(self, method, params):
+        """
+        Return the remembered result data of the correction ``method``
+        called with ``params``, or ``None``.
+
+        """
+        body, _ = self._store.lookup(self._get_key(method, params))
+        return None if body is None else json.loads(body)
+
+    def set(self, method, params, data):
+        self._store.set(self._get_key(method, params), json.dumps(data))
+
+    def correct(self, params):
+        """
+        Return a copy of ``params`` with the artist and track names
+        replaced by the canonical ones, if known.
+
+        """
+        params = dict(params)
+        if 'track' in params and 'artist' in params:
+            data = self.get('track.getCorrection', params)
+            track = _get_correction(data, 'track')
+            if track:
+                params['track'] = track['name']
+                params['artist'] = track['artist']['name']
+        elif 'artist' in params:
+            data = self.get('artist.getCorrection', params)
+            artist = _get_correction(data, 'artist')
+            if artist:
+                params['artist'] = artist['name']
+        return params
+
+    def stats(self):
+        return self._store.stats()
+
+    def close(self):
+        self._store.close()
+
+    def _get_key(self, method, params):
+        key = {'method': method}
+        for name in ('artist', 'track'):
+            if params.get(name) is not None:
+                key[name] = normalize_name(params[name])
+        return encode_params(key)
+
+
+def normalize_name(name):
+    """
+    Return ``name`` Unicode-normalized (NFKC), with runs of whitespace
+    collapsed and stripped, and case-folded; e.g., both ``'Radiohead '``
+    and ``'RADIOHEAD'`` become ``'radiohead'``.
+
+    """
+    if isinstance(name, bytes):
+        name = name.decode('utf8')
+    name = u' '.join(unicodedata.normalize('NFKC', name).split())
+    # ``str.casefold()`` is new in Python 3.3.
+    return getattr(name, 'casefold', name.lower)()
+
+
+def _get_correction(data, kind):
+    """
+    Return the corrected ``kind`` (``'artist'`` or ``'track'``) `dict`
+    from ``*.getCorrection`` result ``data``, or ``None``.
+
+    """
+    if not isinstance(data, dict):
+        # No correction (an empty string).
+        return None
+    correction = data.get('correction')
+    if isinstance(correction, list):
+        correction = correction[0]
+    if not isinstance(correction, dict):
+        return None
+    return correction.get(kind)
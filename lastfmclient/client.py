@@ -1,33 +1,120 @@
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from hashlib import md5
 
-from .api import BaseClient
-from .exceptions import EXCEPTIONS_BY_CODE
+from . import deadline
+from .api import (
+    BaseClient, CACHE_INVALIDATION, CACHE_TTL, MULTIPLE_PARAMS)
+from .cache import (
+    CORRECTION_METHODS, NAME_PARAMS, NEGATIVE_ERRORS, normalize_name)
+from .compat import text_type
+from .exceptions import (
+    EXCEPTIONS_BY_CODE, LastfmError, DeadlineExceededError, TemporaryError)
+from .hedging import HedgingExecutor, HedgingPolicy, hedge
+from .transports import RequestsTransport, decode_params, encode_params
 
 
 API_URL = 'http://ws.audioscrobbler.com/2.0/'
 AUTH_URL = 'http://www.last.fm/api/auth/?api_key={key}&cb={callback}'
 
+#: Types of values expanded into array notation.
+SEQUENCES = (list, tuple)
+
 
 class LastfmClient(BaseClient):
     """
     Blocking Last.fm client.
 
-    Uses ``requests`` to perform HTTP requests.
+    Uses ``requests`` to perform HTTP requests by default (see
+    `lastfmclient.transports.RequestsTransport`). Connections are kept
+    alive in a pool shared by all threads using the client.
 
     """
 
     api_key = None
     api_secret = None
 
-    def __init__(self, api_key=None, api_secret=None, session_key=None):
+    def __init__(self, api_key=None, api_secret=None, session_key=None,
+                 pool_connections=1, pool_maxsize=10, transport=None,
+                 max_workers=10, idle_check_interval=None, timeout=None,
+                 hedging=None, api_url=API_URL, cache=None, cache_ttl=None,
+                 coalesce=False, stale_while_revalidate=False,
+                 normalize_names=False, corrections=None):
         """
         :param api_key: Last.fm API key
         :param api_secret: Last.fm API secret
         :param session_key: Last.fm API user session key
+        :param pool_connections: number of per-host pools to keep
+        :param pool_maxsize: max. number of idle keep-alive connections
+                             kept in each pool
+        :param transport: a `lastfmclient.transports.Transport` instance
+                          to use instead of the default one
+        :param max_workers: max. number of calls in flight in `gather()`
+                            and `map()`
+        :param idle_check_interval: if set, pooled idle connections are
+                                    checked in the background every that
+                                    many seconds, and those closed by the
+                                    server are dropped
+        :param timeout: the default timeout for each call, in seconds
+                        (see also `deadline()`)
+        :param hedging: a `lastfmclient.hedging.HedgingPolicy` (or
+                        ``True`` for the default one) to hedge ``GET``
+                        calls with
+        :param api_url: the API endpoint URL, e.g., to use HTTPS or
+                        a local stand-in server
+        :param cache: a `lastfmclient.cache.Cache` for responses to
+                      unauthenticated ``GET`` calls
+        :param cache_ttl: a `dict` mapping method names to cache TTLs
+                          (``None`` for no caching), overriding the
+                          defaults from `lastfmclient.api.CACHE_TTL` and
+                          the ``cache``'s own ``ttl``
+        :param coalesce: make identical ``GET`` calls made while one is
+                         in flight wait for its response instead of
+                         sending their own request
+        :param stale_while_revalidate: return cached responses that have
+                                       expired (but are still within the
+                                       cache's ``stale_ttl``) right away,
+                                       and refresh them in the background
+        :param normalize_names: normalize the artist, album and track names
+                                in cache keys (see
+                                `lastfmclient.cache.normalize_name()`)
+        :param corrections: a `lastfmclient.cache.CorrectionMemo` to
+                            remember the results of ``*.getCorrection``
+                            calls in
 
         """
         super(LastfmClient, self).__init__()
 
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.idle_check_interval = idle_check_interval
+        self.timeout = timeout
+        self.hedging = HedgingPolicy() if hedging is True else hedging
+        self.api_url = api_url
+        self.cache = cache
+        self.cache_ttl = CACHE_TTL
+        # Methods whose TTL takes precedence over the cache's ``ttl``.
+        self._cache_ttl_overrides = frozenset(cache_ttl or ())
+        if cache_ttl:
+            self.cache_ttl = dict(CACHE_TTL)
+            self.cache_ttl.update(cache_ttl)
+        self.coalesce = coalesce
+        # URL => future response body of the ``GET`` request in flight.
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self.stale_while_revalidate = stale_while_revalidate
+        # Cache keys being refreshed in the background.
+        self._revalidating = set()
+        self.normalize_names = normalize_names
+        self.corrections = corrections
+        self.transport = transport or self._get_default_transport()
+        self.max_workers = max_workers
+        self._executor = None
+        self._hedge_executor = None
+        self._revalidate_executor = None
+        self._executor_lock = threading.Lock()
+
         if api_key:
             self.api_key = api_key
 
@@ -38,6 +125,19 @@ class LastfmClient(BaseClient):
 
         assert self.api_key and self.api_secret, 'Missing API key or secret.'
 
+    def for_session(self, session_key):
+        """
+        Return a `SessionView` of this client for the user with
+        ``session_key``. Views are cheap, so one can be created for each
+        request in a multi-user app::
+
+            api = AsyncLastfmClient(api_key=KEY, api_secret=SECRET)
+            ...
+            yield api.for_session(session_key).track.love(artist, track)
+
+        """
+        return SessionView(self, session_key)
+
     def get_auth_url(self, callback_url):
         """
         Return a URL where the user can confirm this app.
@@ -48,7 +148,7 @@ class LastfmClient(BaseClient):
         """
         return AUTH_URL.format(key=self.api_key, callback=callback_url)
 
-    def call(self, http_method, method, auth, params):
+    def call(self, http_method, method, auth, params, session_key=None):
         """Perform the actual HTTP call and return a response data `dict`.
 
         :param http_method: the name of the HTTP method
@@ -63,19 +163,361 @@ class LastfmClient(BaseClient):
         :param params: parameters passed as GET or POST data.
         :type params: dict
 
+        :param session_key: the session key to sign the call with instead
+                            of ``self.session_key``
+        :type session_key: str
+
         """
+        memoized = self._get_memoized(method, params)
+        if memoized is not None:
+            return memoized
+        url, body = self._get_request(
+            http_method, method, auth, params, session_key)
+        cache_key = self._get_cache_key(http_method, method, auth, url)
+        cached, stale = self._get_cached(cache_key)
+        if cached is not None and not stale:
+            return self._process_response_body(cached)
+
+        def fetch():
+            return self._fetch(http_method, method, url, body, cache_key)
+        if cached is not None:
+            return self._serve_stale(cache_key, cached, fetch)
+        data = fetch()
+        self._update_caches(method, params, data)
+        return data
+
+    def _fetch(self, http_method, method, url, body, cache_key):
+        """Send the request and return the response data."""
+        timeout = self._get_timeout()
+
+        def request():
+            return self.transport.request(http_method, url, body,
+                                          timeout=timeout)
+
+        def fetch():
+            if self.hedging is not None and http_method == 'GET':
+                return hedge(self.hedge_executor, self.hedging, request)
+            return request()
         try:
-            import requests
-        except ImportError:
-            raise RuntimeError(
-                'You need to install requests `pip install '
-                'requests` for LastfmClient to work.'
-            )
-        params = self._get_params(method, params, auth)
-        data = requests.request(http_method, API_URL, params=params).json()
-        return self._process_response_data(data)
+            if self.coalesce and http_method == 'GET':
+                body, leader = self._coalesce(url, fetch, timeout)
+                if not leader:
+                    # The leader has cached the response already.
+                    cache_key = None
+            else:
+                body = fetch()
+        except Exception:
+            self._check_deadline()
+            raise
+        return self._process_response_body(
+            body, cache_key, self._get_cache_ttl(method))
+
+    def _serve_stale(self, cache_key, cached, fetch):
+        """
+        Return the data of the expired ``cached`` response body, either
+        right away while ``fetch`` refreshes it in the background, or
+        when ``fetch`` fails with a temporary error.
+
+        """
+        if self.stale_while_revalidate:
+            self._revalidate(cache_key, fetch)
+            return self._process_response_body(cached)
+        try:
+            return fetch()
+        except LastfmError as e:
+            if not isinstance(e, TemporaryError):
+                raise
+            return self._process_response_body(cached)
+
+    def _revalidate(self, cache_key, fetch):
+        """
+        Call ``fetch`` in the background, unless the response cached under
+        ``cache_key`` is being refreshed already. Errors are ignored; the
+        stale response is served until it is refreshed or drops out of the
+        cache.
+
+        """
+        with self._in_flight_lock:
+            if cache_key in self._revalidating:
+                return
+            self._revalidating.add(cache_key)
+
+        def revalidate():
+            try:
+                fetch()
+            except Exception:
+                pass
+            finally:
+                with self._in_flight_lock:
+                    self._revalidating.discard(cache_key)
+        self.revalidate_executor.submit(revalidate)
+
+    def _coalesce(self, url, fetch, timeout):
+        """
+        Return the response body for ``url``, calling ``fetch`` only if no
+        identical request is in flight already; otherwise, wait for that
+        one. Return ``(body, leader)``, where ``leader`` is ``True`` if
+        ``fetch`` has been called.
+
+        """
+        with self._in_flight_lock:
+            future = self._in_flight.get(url)
+            leader = future is None
+            if leader:
+                future = self._in_flight[url] = Future()
+        if not leader:
+            return future.result(timeout), False
+        try:
+            body = fetch()
+        except BaseException as e:
+            # Even, e.g., `KeyboardInterrupt` must not leave the waiting
+            # threads blocked.
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(body)
+            return body, True
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[url]
+
+    def _get_cache_key(self, http_method, method, auth, url):
+        """
+        Return the cache key for the request, or ``None`` if it should not
+        be cached. Only unauthenticated ``GET`` calls with a TTL (see
+        ``cache_ttl``) are, and the key is their canonical query string.
+
+        """
+        if self.cache is None or http_method != 'GET' or auth:
+            return None
+        if method in self.cache_ttl and self.cache_ttl[method] is None:
+            return None
+        query = url.partition('?')[2]
+        if 'api_sig=' in query:
+            # Signed even though ``auth=False`` (``user.getInfo``).
+            return None
+        if self.normalize_names:
+            params = decode_params(url)
+            if (self.corrections is not None
+                    and params.get('autocorrect') == '1'):
+                params = self.corrections.correct(params)
+            query = encode_params(self._normalize_names(params))
+        return query
+
+    def _normalize_names(self, params):
+        """Return a copy of ``params`` with normalized names."""
+        return {name: normalize_name(value) if name in NAME_PARAMS else value
+                for name, value in params.items()}
+
+    def _get_cache_ttl(self, method):
+        """
+        Return the TTL for the responses to ``method``: the one given in
+        ``cache_ttl``, else the cache's own ``ttl`` if set, else the
+        default from `lastfmclient.api.CACHE_TTL`.
+
+        """
+        ttl = self.cache_ttl.get(method)
+        if (method not in self._cache_ttl_overrides
+                and getattr(self.cache, 'ttl', None) is not None):
+            ttl = self.cache.ttl
+        return ttl
+
+    def _get_memoized(self, method, params):
+        """Return the remembered result data of a correction call."""
+        if self.corrections is None or method not in CORRECTION_METHODS:
+            return None
+        return self.corrections.get(method, params)
+
+    def _update_caches(self, method, params, data):
+        """Called with the result ``data`` of a successful call."""
+        if self.corrections is not None and method in CORRECTION_METHODS:
+            self.corrections.set(method, params, data)
+        self._invalidate(method, params)
+
+    def _invalidate(self, method, params):
+        """
+        Drop the cached responses made stale by a successful call to the
+        write ``method`` (see `lastfmclient.api.CACHE_INVALIDATION`).
+
+        """
+        if self.cache is None or method not in CACHE_INVALIDATION:
+            return
+        for read_method, names in CACHE_INVALIDATION[method].items():
+            match = {'method': read_method}
+            for name in names:
+                value = params.get(name)
+                # Several values (see ``MULTIPLE_PARAMS``) match any.
+                if value is not None and not isinstance(value, SEQUENCES):
+                    match[name] = value
+            matches = [match]
+            if self.normalize_names:
+                if self.corrections is not None:
+                    # Calls with ``autocorrect=1`` are cached under the
+                    # canonical names.
+                    corrected = self.corrections.correct(match)
+                    if corrected != match:
+                        matches.append(corrected)
+                matches = [self._normalize_names(match) for match in matches]
+            for match in matches:
+                self.cache.invalidate(match)
+
+    def _get_cached(self, cache_key):
+        """
+        Return ``(body, stale)`` for the response cached under
+        ``cache_key``, or ``(None, False)``.
+
+        """
+        if cache_key is None:
+            return None, False
+        return self.cache.lookup(cache_key)
+
+    def _get_timeout(self):
+        """
+        Return the timeout for a call given the default timeout and the
+        deadline in effect.
+
+        :raises DeadlineExceededError: the deadline has expired
+
+        """
+        return deadline.get_timeout(self.timeout)
+
+    def _check_deadline(self):
+        """
+        Called when a request fails. If the deadline in effect has expired,
+        the failure was most likely caused by the shortened timeout, so
+        report it as `DeadlineExceededError`.
+
+        """
+        if deadline.expired():
+            raise DeadlineExceededError()
+
+    def deadline(self, timeout):
+        """
+        Return a context manager limiting the total time spent by all the
+        calls made within it (including those run by `gather()`)::
+
+            with api.deadline(2):
+                artist = api.artist.get_info('Radiohead')
+                similar = api.artist.get_similar('Radiohead')
+
+        Each call gets at most the time left. Once it is spent, further
+        calls raise `lastfmclient.exceptions.DeadlineExceededError`.
+
+        """
+        return deadline.deadline(timeout)
 
-    def _get_params(self, method, params, auth):
+    def _get_default_transport(self):
+        return RequestsTransport(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            idle_check_interval=self.idle_check_interval,
+        )
+
+    def warmup(self, n=1):
+        """
+        Open up to ``n`` connections to the API ahead of time, so that the
+        first calls don't pay for connecting. Return the number of ready
+        connections (or a future resolving to it for async transports).
+
+        """
+        return self.transport.warmup(self.api_url, n)
+
+    @property
+    def executor(self):
+        """The thread pool used by `gather()` and `map()`."""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            return self._executor
+
+    @property
+    def hedge_executor(self):
+        """
+        The `lastfmclient.hedging.HedgingExecutor` running hedged requests
+        and their duplicates. Calls finding all its threads busy are sent
+        unhedged from their own threads.
+
+        """
+        with self._executor_lock:
+            if self._hedge_executor is None:
+                # Room for a request and its duplicate per connection.
+                self._hedge_executor = HedgingExecutor(
+                    2 * max(self.max_workers, self.pool_maxsize))
+            return self._hedge_executor
+
+    @property
+    def revalidate_executor(self):
+        """
+        The thread pool refreshing stale responses in the background, kept
+        apart so that they don't hold up `gather()` and `map()`.
+
+        """
+        with self._executor_lock:
+            if self._revalidate_executor is None:
+                self._revalidate_executor = ThreadPoolExecutor(
+                    max(self.max_workers // 2, 1))
+            return self._revalidate_executor
+
+    def gather(self, *calls):
+        """
+        Run ``calls`` concurrently and return a `list` of their results
+        in the same order.
+
+        At most ``max_workers`` calls are in flight at a time. A call
+        failing with a `lastfmclient.exceptions.LastfmError` does not abort
+        the batch; the exception is returned in place of its result.
+
+        :param calls: callables taking no arguments, e.g.,
+                      ``functools.partial(api.artist.get_info, 'Radiohead')``
+
+        """
+        current = deadline.get_current()
+        futures = [self.executor.submit(_capture_errors, call, current)
+                   for call in calls]
+        return [future.result() for future in futures]
+
+    def map(self, func, *iterables):
+        """
+        Like `gather()` but call ``func`` with arguments taken from each of
+        the ``iterables``, as the built-in `map()` does::
+
+            infos = api.map(api.artist.get_info, artists)
+
+        """
+        return self.gather(*[_bind(func, args) for args in zip(*iterables)])
+
+    def pool_stats(self):
+        """Return a `dict` with the transport's connection pool counters."""
+        return self.transport.pool_stats()
+
+    def close(self):
+        """Close all pooled connections and threads."""
+        with self._executor_lock:
+            executors = [self._executor, self._hedge_executor,
+                         self._revalidate_executor]
+            for executor in executors:
+                if executor is not None:
+                    executor.shutdown()
+            self._executor = self._hedge_executor = None
+            self._revalidate_executor = None
+        self.transport.close()
+
+    def _get_request(self, http_method, method, auth, params,
+                     session_key=None):
+        """
+        Return the final request URL and body.
+
+        The signed parameters are encoded once; ``POST`` requests send them
+        as a form-encoded body, others in the query string.
+
+        """
+        query = encode_params(
+            self._get_params(method, params, auth, session_key))
+        if http_method == 'POST':
+            return self.api_url, query.encode('ascii')
+        return self.api_url + '?' + query, None
+
+    def _get_params(self, method, params, auth, session_key=None):
         """Return a `dict` of final request parameters."""
         if params is None:
             params = {}
@@ -90,6 +532,9 @@ class LastfmClient(BaseClient):
         params = {k.rstrip('_'): v for k, v in params.items()
                   if v is not None and k != 'callback'}
 
+        if method in MULTIPLE_PARAMS:
+            params = _expand_multiple(params, MULTIPLE_PARAMS[method])
+
         getting_session = method == 'auth.getSession'
 
         needs_auth = auth or getting_session or (
@@ -97,8 +542,9 @@ class LastfmClient(BaseClient):
 
         if needs_auth:
             if not getting_session:
-                assert self.session_key, 'Missing session key.'
-                params['sk'] = self.session_key
+                session_key = session_key or self.session_key
+                assert session_key, 'Missing session key.'
+                params['sk'] = session_key
 
             params['api_sig'] = self._get_sig(params)
 
@@ -107,10 +553,48 @@ class LastfmClient(BaseClient):
     def _get_sig(self, params):
         """Create a signature as per http://www.last.fm/api/authspec#8."""
         exclude = {'format', 'callback'}
-        sig = ''.join(k + unicode(v).encode('utf8') for k, v
-                      in sorted(params.items()) if k not in exclude)
+        # Sorted by code point, i.e., ``artist[10]`` before ``artist[1]``.
+        sig = u''.join(k + text_type(params[k])
+                       for k in sorted(params) if k not in exclude)
         sig += self.api_secret
-        return md5(sig).hexdigest()
+        return md5(sig.encode('utf8')).hexdigest()
+
+    def _process_response_body(self, body, cache_key=None, ttl=None):
+        """
+        :param body: the raw response body
+        :type body: str
+
+        :param cache_key: if given, the body is cached under it, unless
+                          the response is an error (other than one of
+                          `lastfmclient.cache.NEGATIVE_ERRORS`)
+
+        :param ttl: the cache TTL (``None`` for the cache's default)
+
+        """
+        if isinstance(body, bytes):
+            body = body.decode('utf8')
+        data = json.loads(body)
+        if cache_key is not None:
+            if 'error' not in data:
+                self.cache.set(cache_key, body, ttl)
+            elif self._is_negative(data):
+                negative_ttl = self.cache.negative_ttl
+                if ttl is not None:
+                    negative_ttl = min(negative_ttl, ttl)
+                self.cache.set(cache_key, body, negative_ttl)
+        return self._process_response_data(data)
+
+    def _is_negative(self, data):
+        """
+        Return ``True`` if ``data`` is an error response that should be
+        cached for the cache's ``negative_ttl``.
+
+        """
+        if not self.cache.negative_ttl:
+            return False
+        error_class = EXCEPTIONS_BY_CODE.get(int(data['error']))
+        return (error_class is not None
+                and issubclass(error_class, NEGATIVE_ERRORS))
 
     def _process_response_data(self, data):
         """
@@ -126,9 +610,68 @@ class LastfmClient(BaseClient):
             )
 
         if isinstance(data, dict):
-            keys = data.keys()
+            keys = list(data)
             if len(keys) == 1:
                 return data[keys[0]]
 
         return data
 
+
+class SessionView(BaseClient):
+    """
+    A client view signing calls with a user's session key. Everything else,
+    including the connection pool, caches and limits, is shared with the
+    underlying client, to which all other attributes are delegated.
+
+    """
+
+    def __init__(self, client, session_key):
+        self.client = client
+        self.session_key = session_key
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def __repr__(self):
+        return '<SessionView of %r>' % self.client
+
+    def call(self, http_method, method, auth, params):
+        return self.client.call(http_method, method, auth, params,
+                                session_key=self.session_key)
+
+    def for_session(self, session_key):
+        return SessionView(self.client, session_key)
+
+
+def _expand_multiple(params, multiple):
+    """
+    Return a copy of ``params`` with the sequences of values of the
+    ``multiple`` parameters expanded into array notation, e.g.,
+    ``artist=['Cher', 'Blur']`` into ``artist[0]=Cher&artist[1]=Blur``.
+    ``None`` values are skipped, keeping the indexes of the others.
+
+    """
+    expanded = {}
+    for name, value in params.items():
+        if name in multiple and isinstance(value, SEQUENCES):
+            template, first = multiple[name]
+            for i, item in enumerate(value, first):
+                if item is not None:
+                    expanded[template % i] = item
+        else:
+            expanded[name] = value
+    return expanded
+
+
+def _bind(func, args):
+    return lambda: func(*args)
+
+
+def _capture_errors(call, current_deadline):
+    deadline.set_current(current_deadline)
+    try:
+        return call()
+    except LastfmError as e:
+        return e
+    finally:
+        deadline.set_current(None)
@@ -0,0 +1,23 @@
+"""
+Python 2/3 compatibility.
+
+"""
+import sys
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2.
+    from time import time as monotonic
+
+
+is_py2 = sys.version_info[0] == 2
+
+
+if is_py2:
+    text_type = unicode
+    from urllib import urlencode
+    from urlparse import parse_qsl
+else:
+    text_type = str
+    from urllib.parse import urlencode, parse_qsl
@@ -0,0 +1,113 @@
+"""
+End-to-end deadlines carrying a total time budget through several calls::
+
+    with deadline(2.5):
+        artist = api.artist.get_info('Radiohead')
+        tracks = api.artist.get_top_tracks('Radiohead')
+
+Each call gets at most the time left, and once the budget is spent, any
+further calls fail with `DeadlineExceededError` without being sent.
+
+The current deadline is kept in a context variable where available, so it
+follows asyncio tasks as well as threads.
+
+"""
+from contextlib import contextmanager
+
+from .compat import monotonic
+from .exceptions import DeadlineExceededError
+
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    # Python < 3.7.
+    import threading
+
+    class ContextVar(object):
+
+        def __init__(self, name, default=None):
+            self._local = threading.local()
+            self._default = default
+
+        def get(self):
+            return getattr(self._local, 'value', self._default)
+
+        def set(self, value):
+            self._local.value = value
+
+
+_current = ContextVar('lastfmclient_deadline', default=None)
+
+
+class Deadline(object):
+
+    def __init__(self, timeout):
+        """
+        :param timeout: the time budget in seconds
+
+        """
+        self.expires = monotonic() + timeout
+
+    def remaining(self):
+        """Return the number of seconds left (never negative)."""
+        return max(self.expires - monotonic(), 0)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def __repr__(self):
+        return '<Deadline: %.3fs left>' % self.remaining()
+
+
+def get_current():
+    """Return the `Deadline` in effect or ``None``."""
+    return _current.get()
+
+
+def set_current(value):
+    """Make ``value`` (a `Deadline` or ``None``) the deadline in effect."""
+    _current.set(value)
+
+
+@contextmanager
+def deadline(timeout):
+    """
+    Run the block with a `Deadline` of ``timeout`` seconds. A nested
+    deadline cannot extend the one in effect.
+
+    """
+    outer = get_current()
+    inner = Deadline(timeout)
+    if outer is not None and outer.expires < inner.expires:
+        inner = outer
+    set_current(inner)
+    try:
+        yield inner
+    finally:
+        set_current(outer)
+
+
+def expired():
+    """Return ``True`` if the current deadline, if any, has expired."""
+    current = get_current()
+    return current is not None and current.expired()
+
+
+def get_timeout(timeout=None):
+    """
+    Return the timeout for a call: the smaller of ``timeout`` and the time
+    left until the current deadline, if any.
+
+    :raises DeadlineExceededError: the current deadline has expired
+
+    """
+    current = get_current()
+    if current is None:
+        return timeout
+    remaining = current.remaining()
+    if remaining <= 0:
+        raise DeadlineExceededError()
+    if timeout is None:
+        return remaining
+    return min(timeout, remaining)
@@ -158,3 +158,25 @@ class RateLimitExceededError(LastfmError, TemporaryError, ClientError):
 
 for cls in LastfmError.__subclasses__():
     EXCEPTIONS_BY_CODE[cls.code] = cls
+
+
+### Client-side errors without an API error code.
+class DeadlineExceededError(LastfmError):
+    """Deadline exceeded - The time budget has been spent"""
+
+    def __init__(self, message='No time left for the call.'):
+        # Skip `LastfmError.__init__()`, and keep ``message`` in ``args``
+        # so that the exception can be pickled.
+        super(LastfmError, self).__init__(message)
+        doc = ' '.join(type(self).__doc__.split())
+        self.message = '%s: %s' % (doc, message)
+
+
+class NetworkError(LastfmError, TemporaryError):
+    """Network error - The request timed out or the connection failed"""
+
+    def __init__(self, message):
+        # See `DeadlineExceededError`.
+        super(LastfmError, self).__init__(message)
+        doc = ' '.join(type(self).__doc__.split())
+        self.message = '%s: %s' % (doc, message)
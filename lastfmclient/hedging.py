@@ -0,0 +1,182 @@
+"""
+Hedged requests for idempotent (``GET``) calls.
+
+If a request hasn't completed within a delay derived from the recently
+observed latencies (e.g., their 95th percentile), an identical second
+request is sent, and whichever response comes first is used. The other
+request is cancelled if possible, and its result ignored otherwise.
+
+Blocking calls run both requests on a `HedgingExecutor`, and wait for the
+first response. When all its threads are busy, a call runs its request
+itself without hedging rather than queue for one.
+
+To keep hedges from multiplying the request rate, they are paid for from a
+budget that every sent request tops up by a fraction of a hedge.
+
+"""
+import threading
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED, ThreadPoolExecutor
+
+from .compat import monotonic
+
+
+class HedgingPolicy(object):
+
+    def __init__(self, percentile=95, initial_delay=1.0, min_delay=0.01,
+                 budget=0.05, max_budget=10, window=1000, min_samples=20):
+        """
+        :param percentile: hedge requests slower than this percentile of
+                           the recent latencies
+        :param initial_delay: the delay used until ``min_samples``
+                              latencies have been observed, in seconds
+        :param min_delay: the shortest delay ever used, in seconds
+        :param budget: the fraction of a hedge earned by each request;
+                       ``0.05`` allows at most 5% of requests to be hedged
+        :param max_budget: the max. number of hedges that can be saved up
+                           for a burst
+        :param window: the number of recent latencies to keep
+
+        """
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.budget = budget
+        self.max_budget = max_budget
+        self.min_samples = min_samples
+        self.hedges = 0
+        self.requests = 0
+        self._latencies = deque(maxlen=window)
+        self._recorded = 0
+        self._delay = initial_delay
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Return the number of seconds to wait before hedging."""
+        return self._delay
+
+    def record(self, latency):
+        """Record the ``latency`` of a completed request, in seconds."""
+        with self._lock:
+            self._latencies.append(latency)
+            self._recorded += 1
+            n = len(self._latencies)
+            # Sorting on every request would be wasteful.
+            if n >= self.min_samples and self._recorded % 10 == 0:
+                ordered = sorted(self._latencies)
+                i = min(int(n * self.percentile / 100.0), n - 1)
+                self._delay = max(ordered[i], self.min_delay)
+
+    def start(self):
+        """Account for a request being sent."""
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self._tokens + self.budget, self.max_budget)
+
+    def acquire(self):
+        """Return ``True`` if a hedge can be sent, and account for it."""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'hedges': self.hedges,
+            'delay': self._delay,
+        }
+
+
+class HedgingExecutor(object):
+    """
+    A thread pool that only accepts work when it has a free thread, so
+    that hedged requests never wait in a queue.
+
+    """
+
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def try_submit(self, func, condition=None):
+        """
+        Run ``func`` on a free thread and return its future, or return
+        ``None`` if there is none, or if ``condition`` (a callable
+        called once a thread is reserved) returns ``False``.
+
+        """
+        if not self._slots.acquire(False):
+            return None
+        if condition is not None and not condition():
+            self._slots.release()
+            return None
+        future = self._executor.submit(func)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait)
+
+
+def hedge(executor, policy, request):
+    """
+    Run ``request`` (a callable taking no arguments) on ``executor`` (a
+    `HedgingExecutor`) and hedge it according to ``policy``. Return the
+    first successful result, or raise the first error if both attempts
+    fail. If ``executor`` has no free thread, just return ``request()``.
+
+    """
+    primary = _Attempt(request)
+    future = executor.try_submit(primary)
+    if future is None:
+        return request()
+    policy.start()
+
+    def record(future):
+        if not future.cancelled() and future.exception() is None:
+            policy.record(primary.latency)
+    future.add_done_callback(record)
+    # Only wait from when the request is actually sent.
+    primary.started.wait()
+    futures = [future]
+    done, _ = wait(futures, timeout=policy.delay())
+    if not done:
+        duplicate = executor.try_submit(_Attempt(request), policy.acquire)
+        if duplicate is not None:
+            futures.append(duplicate)
+    return _first_successful(futures)
+
+
+class _Attempt(object):
+    """A request, timed from when it starts running."""
+
+    def __init__(self, request):
+        self.request = request
+        self.started = threading.Event()
+        self.latency = None
+
+    def __call__(self):
+        started = monotonic()
+        self.started.set()
+        try:
+            return self.request()
+        finally:
+            self.latency = monotonic() - started
+
+
+def _first_successful(futures):
+    pending = set(futures)
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    loser.cancel()
+                return future.result()
+            error = error or future.exception()
+    raise error
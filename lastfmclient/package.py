@@ -7,3 +7,21 @@ class Package(object):
     def _call(self, http_method, method, auth, **params):
         method = '%s.%s' % (self._name, method)
         return self._client.call(http_method, method, auth, params)
+
+
+class package_property(object):
+    """
+    Create a package for a client on first access, and store it on the
+    client, so that later accesses are plain attribute lookups.
+
+    """
+
+    def __init__(self, package_class):
+        self.package_class = package_class
+        self.name = package_class.__name__.lower()
+
+    def __get__(self, client, owner=None):
+        if client is None:
+            return self
+        package = client.__dict__[self.name] = self.package_class(client)
+        return package
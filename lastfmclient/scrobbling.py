@@ -0,0 +1,687 @@
+"""
+Batched scrobbling.
+
+``track.scrobble`` accepts up to 50 plays per call in array notation
+(``artist[0]``, ``track[0]``, ...). `ScrobbleBatcher` takes single plays,
+buffers them per session key, and sends them in such batches::
+
+    batcher = ScrobbleBatcher(api, max_delay=10)
+    future = batcher.scrobble(session_key, 'Radiohead', 'Airbag',
+                              timestamp=1400000000)
+    ...
+    future.result()  # {'artist': {...}, 'ignoredMessage': {...}, ...}
+
+`ScrobbleQueue` stores plays durably in an SQLite database first, and
+sends them in the background, so that none are lost while Last.fm is
+down or when the process restarts.
+
+`ScrobbleDispatcher` shares a rate budget fairly among users, so that one
+importing their history does not hold up everyone else's plays.
+
+`NowPlayingCoalescer` holds ``track.updateNowPlaying`` calls for a short
+window, and only sends the latest one of each user.
+
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from .exceptions import LastfmError, TemporaryError
+from .utils import Periodic, TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+#: The max. number of plays per ``track.scrobble`` call.
+MAX_BATCH = 50
+
+#: Optional per-play ``track.scrobble`` parameters.
+SCROBBLE_PARAMS = frozenset([
+    'album', 'albumArtist', 'chosenByUser', 'context', 'duration', 'mbid',
+    'streamId', 'trackNumber',
+])
+
+
+class ScrobbleBatcher(object):
+    """
+    Buffers plays per session key, and scrobbles a batch once it has
+    ``max_batch`` plays, or its oldest play has waited for ``max_delay``
+    seconds. Batches are sent on the client's thread pool.
+
+    """
+
+    def __init__(self, client, max_batch=MAX_BATCH, max_delay=10.0):
+        """
+        :param client: a `lastfmclient.LastfmClient`
+        :param max_batch: the max. number of plays per call
+        :param max_delay: the max. number of seconds a play is buffered for
+
+        """
+        assert 0 < max_batch <= MAX_BATCH
+        self.client = client
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        # session key => [(play, future)]
+        self._pending = {}
+        # session key => time by which its plays must be sent
+        self._due = {}
+        self._lock = threading.Lock()
+        self._flusher = Periodic(self._flush_due, min(max_delay / 4.0, 1.0),
+                                 name='lastfmclient-scrobble-batcher')
+
+    def scrobble(self, session_key, artist, track, timestamp, **params):
+        """
+        Buffer a play for the user with ``session_key``, and return a
+        `concurrent.futures.Future` resolving to its entry in the
+        ``track.scrobble`` response.
+
+        :param params: other ``track.scrobble`` parameters (see
+                       `SCROBBLE_PARAMS`)
+
+        """
+        play = _make_play(artist, track, timestamp, params)
+        future = Future()
+        with self._lock:
+            batch = self._pending.setdefault(session_key, [])
+            if not batch:
+                self._due[session_key] = time.time() + self.max_delay
+            batch.append((play, future))
+            if len(batch) >= self.max_batch:
+                self._send(session_key)
+        return future
+
+    def flush(self):
+        """Send all the buffered plays now."""
+        with self._lock:
+            for session_key in list(self._pending):
+                self._send(session_key)
+
+    def pending(self):
+        """Return the number of buffered plays."""
+        with self._lock:
+            return sum(len(batch) for batch in self._pending.values())
+
+    def close(self):
+        """Stop the background thread and send the buffered plays."""
+        self._flusher.stop()
+        self.flush()
+
+    def _flush_due(self):
+        now = time.time()
+        with self._lock:
+            for session_key, due in list(self._due.items()):
+                if due <= now:
+                    self._send(session_key)
+
+    def _send(self, session_key):
+        """Submit the buffered batch of ``session_key``; the lock is held."""
+        batch = self._pending.pop(session_key)
+        del self._due[session_key]
+        self.batches += 1
+        self.client.executor.submit(_send, self.client, session_key, batch)
+
+
+def _get_scrobbles(result):
+    """
+    Return the `list` of per-play entries of a ``track.scrobble`` result,
+    which has a single `dict` in place of the list for one play.
+
+    """
+    scrobbles = result.get('scrobble', []) if isinstance(result, dict) else []
+    if isinstance(scrobbles, dict):
+        scrobbles = [scrobbles]
+    return scrobbles
+
+
+class ScrobbleQueue(object):
+    """
+    Durable queue of plays to scrobble, in an SQLite database.
+
+    `scrobble()` only buffers a play; a writer thread commits the buffered
+    plays to disk together (a group commit, with one ``fsync``) every
+    ``commit_interval`` seconds. A drainer thread sends the stored plays
+    in batches of up to 50 per session key. After a temporary failure
+    (a `lastfmclient.exceptions.TemporaryError` or a network error), the
+    plays of that session key are retried with exponential backoff;
+    after any other error, they are marked as failed (see `failed()`).
+
+    Plays are deduplicated on their session key, timestamp, artist and
+    track, including against those sent within ``dedupe_window``. Plays
+    left in the database by a previous process are sent on start.
+
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS scrobbles (
+            id INTEGER PRIMARY KEY,
+            session_key TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            track TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            params TEXT NOT NULL,
+            state INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL DEFAULT 0,
+            updated REAL NOT NULL,
+            error TEXT,
+            UNIQUE (session_key, timestamp, artist, track)
+        );
+        CREATE INDEX IF NOT EXISTS scrobbles_state
+            ON scrobbles (state, next_attempt);
+    """
+
+    PENDING, SENT, FAILED = 0, 1, 2
+
+    def __init__(self, client, path, commit_interval=0.01, drain_interval=1.0,
+                 batch_size=MAX_BATCH, min_backoff=1.0, max_backoff=600.0,
+                 dedupe_window=24 * 3600):
+        """
+        :param client: a `lastfmclient.LastfmClient`
+        :param path: path to the database file
+        :param commit_interval: the number of seconds plays are buffered
+                                for before being committed together
+        :param drain_interval: the number of seconds between checks for
+                               plays to send
+        :param batch_size: the max. number of plays per call
+        :param min_backoff: the delay before the first retry, in seconds;
+                            it doubles with each further attempt
+        :param max_backoff: the longest delay between retries
+        :param dedupe_window: the number of seconds sent plays are kept
+                              for to detect duplicates
+
+        """
+        assert 0 < batch_size <= MAX_BATCH
+        self.client = client
+        self.path = path
+        self.commit_interval = commit_interval
+        self.batch_size = batch_size
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.dedupe_window = dedupe_window
+        # [(row, future)] to be committed.
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._local = threading.local()
+        with self._connection as db:
+            db.executescript(self.SCHEMA)
+        self._writer = threading.Thread(target=self._write,
+                                        name='lastfmclient-scrobble-writer')
+        self._writer.daemon = True
+        self._writer.start()
+        self._drainer = Periodic(self.drain, drain_interval,
+                                 name='lastfmclient-scrobble-drainer')
+
+    @property
+    def _connection(self):
+        """The database connection of the current thread."""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute('PRAGMA journal_mode = WAL')
+            # ``fsync`` on every commit.
+            db.execute('PRAGMA synchronous = FULL')
+            self._local.db = db
+        return db
+
+    def scrobble(self, session_key, artist, track, timestamp, **params):
+        """
+        Queue a play for the user with ``session_key``, and return
+        a `concurrent.futures.Future` resolving to ``True`` once it is
+        stored, or to ``False`` if it is a duplicate.
+
+        :param params: other ``track.scrobble`` parameters (see
+                       `SCROBBLE_PARAMS`)
+
+        """
+        assert not self._closed, 'The queue is closed.'
+        play = _make_play(artist, track, timestamp, params)
+        row = (
+            session_key,
+            play.pop('artist'),
+            play.pop('track'),
+            int(play.pop('timestamp')),
+            json.dumps(play),
+            time.time(),
+        )
+        future = Future()
+        with self._lock:
+            self._buffer.append((row, future))
+        self._wakeup.set()
+        return future
+
+    def _write(self):
+        while not self._closed:
+            self._wakeup.wait()
+            # Let more plays join the group.
+            time.sleep(self.commit_interval)
+            self._wakeup.clear()
+            self._commit()
+
+    def _commit(self):
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+        if not buffer:
+            return
+        try:
+            with self._connection as db:
+                # New plays join the backoff of the user's pending ones.
+                stored = [db.execute(
+                    'INSERT OR IGNORE INTO scrobbles (session_key, artist,'
+                    ' track, timestamp, params, updated, attempts,'
+                    ' next_attempt)'
+                    ' SELECT ?, ?, ?, ?, ?, ?, COALESCE(MAX(attempts), 0),'
+                    ' COALESCE(MAX(next_attempt), 0) FROM scrobbles'
+                    ' WHERE session_key = ? AND state = ?',
+                    row + (row[0], self.PENDING)).rowcount == 1
+                    for row, _ in buffer]
+        except Exception as e:
+            for _, future in buffer:
+                future.set_exception(e)
+        else:
+            for (_, future), is_new in zip(buffer, stored):
+                future.set_result(is_new)
+
+    def drain(self):
+        """
+        Send the plays that are due, in batches per session key, and
+        return the number of plays sent.
+
+        """
+        with self._drain_lock:
+            return self._drain()
+
+    def _drain(self):
+        db = self._connection
+        now = time.time()
+        with db:
+            db.execute('DELETE FROM scrobbles WHERE state = ? AND updated < ?',
+                       (self.SENT, now - self.dedupe_window))
+        session_keys = [sk for sk, in db.execute(
+            'SELECT session_key FROM scrobbles'
+            ' WHERE state = ? AND next_attempt <= ?'
+            ' GROUP BY session_key ORDER BY MIN(id)',
+            (self.PENDING, now))]
+        sent = 0
+        for session_key in session_keys:
+            while not self._closed:
+                count = self._send_batch(session_key)
+                sent += max(count, 0)
+                if count < self.batch_size:
+                    break
+        return sent
+
+    def _send_batch(self, session_key):
+        """
+        Send the oldest pending plays of ``session_key``. Return their
+        number, or ``-1`` if the batch failed.
+
+        """
+        db = self._connection
+        rows = db.execute(
+            'SELECT id, artist, track, timestamp, params, attempts'
+            ' FROM scrobbles WHERE session_key = ? AND state = ?'
+            ' AND next_attempt <= ? ORDER BY id LIMIT ?',
+            (session_key, self.PENDING, time.time(),
+             self.batch_size)).fetchall()
+        if not rows:
+            return 0
+        plays = []
+        for _, artist, track, timestamp, params, _ in rows:
+            play = json.loads(params)
+            play.update(artist=artist, track=track, timestamp=timestamp)
+            plays.append(play)
+        ids = [row[0] for row in rows]
+        now = time.time()
+        try:
+            _scrobble(self.client, session_key, plays)
+        except LastfmError as e:
+            if isinstance(e, TemporaryError):
+                self._retry(session_key, rows[0][5])
+            else:
+                with db:
+                    db.executemany(
+                        'UPDATE scrobbles SET state = ?, error = ?,'
+                        ' updated = ? WHERE id = ?',
+                        [(self.FAILED, str(e), now, id_) for id_ in ids])
+            return -1
+        except Exception:
+            self._retry(session_key, rows[0][5])
+            return -1
+        with db:
+            db.executemany(
+                'UPDATE scrobbles SET state = ?, updated = ? WHERE id = ?',
+                [(self.SENT, now, id_) for id_ in ids])
+        return len(rows)
+
+    def _retry(self, session_key, attempts):
+        """Back off the pending plays of ``session_key``."""
+        delay = min(self.min_backoff * 2 ** attempts, self.max_backoff)
+        with self._connection as db:
+            db.execute(
+                'UPDATE scrobbles SET attempts = attempts + 1,'
+                ' next_attempt = ? WHERE session_key = ? AND state = ?',
+                (time.time() + delay, session_key, self.PENDING))
+
+    def pending(self):
+        """Return the number of plays waiting to be sent."""
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM scrobbles WHERE state = ?',
+            (self.PENDING,)).fetchone()[0]
+
+    def failed(self):
+        """
+        Return a `list` of ``(session_key, artist, track, timestamp,
+        error)`` tuples for the plays Last.fm has refused.
+
+        """
+        return self._connection.execute(
+            'SELECT session_key, artist, track, timestamp, error'
+            ' FROM scrobbles WHERE state = ? ORDER BY id',
+            (self.FAILED,)).fetchall()
+
+    def close(self):
+        """
+        Stop the background threads and commit the buffered plays; those
+        not sent yet will be sent by the next queue using the database.
+
+        """
+        self._closed = True
+        self._drainer.stop()
+        self._wakeup.set()
+        self._writer.join()
+        self._commit()
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+class ScrobbleDispatcher(object):
+    """
+    Sends plays of many users through one API key fairly.
+
+    Plays are queued per session key. The queues are served by deficit
+    round robin: on its turn, a session key earns ``quantum`` times its
+    weight in plays, and its plays are sent in batches of up to 50 while
+    the credit lasts. Each call takes a token from a bucket shared by all
+    users, which caps the request rate.
+
+    Users with a few plays are thus served within a round, while a bulk
+    import only gets its share of each round and uses the capacity left.
+    Plays accumulating while the rate is saturated are sent in larger
+    batches.
+
+    """
+
+    def __init__(self, client, rate=5.0, burst=None, quantum=MAX_BATCH,
+                 weights=None, default_weight=1.0):
+        """
+        :param client: a `lastfmclient.LastfmClient`
+        :param rate: the max. average number of calls per second
+        :param burst: the max. number of calls that can be made at once
+                      after being idle (``rate`` by default)
+        :param quantum: the number of plays a session key of weight ``1``
+                        can send per round
+        :param weights: a `dict` mapping session keys to their weights
+        :param default_weight: the weight of other session keys, e.g.,
+                               higher than that of bulk imports
+
+        """
+        self.client = client
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.quantum = quantum
+        self.weights = {}
+        for session_key, weight in (weights or {}).items():
+            self.weights[session_key] = _check_weight(weight)
+        self.default_weight = _check_weight(default_weight)
+        self.batches = 0
+        # session key => deque([(play, future)])
+        self._queues = {}
+        # Session keys with queued plays, the one on turn first.
+        self._active = deque()
+        # session key => plays it may still send on its turn
+        self._deficits = {}
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name='lastfmclient-scrobble-dispatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def set_weight(self, session_key, weight):
+        """
+        :raises ValueError: ``weight`` is not positive
+
+        """
+        weight = _check_weight(weight)
+        with self._condition:
+            self.weights[session_key] = weight
+
+    def scrobble(self, session_key, artist, track, timestamp, **params):
+        """
+        Queue a play for the user with ``session_key``, and return a
+        `concurrent.futures.Future` resolving to its entry in the
+        ``track.scrobble`` response.
+
+        :param params: other ``track.scrobble`` parameters (see
+                       `SCROBBLE_PARAMS`)
+
+        """
+        play = _make_play(artist, track, timestamp, params)
+        future = Future()
+        with self._condition:
+            assert not self._closed, 'The dispatcher is closed.'
+            queue = self._queues.get(session_key)
+            if queue is None:
+                queue = self._queues[session_key] = deque()
+                self._active.append(session_key)
+                self._deficits[session_key] = 0
+                self._condition.notify()
+            queue.append((play, future))
+        return future
+
+    def pending(self):
+        """Return the number of queued plays."""
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def close(self):
+        """Send the queued plays, and stop the dispatcher thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._active and not self._closed:
+                    self._condition.wait()
+                if not self._active:
+                    return
+            try:
+                self._dispatch()
+            except Exception:
+                # Keep serving the other users.
+                logger.exception('Cannot dispatch scrobbles')
+
+    def _dispatch(self):
+        # Plays can keep arriving while waiting for the budget.
+        self.rate_limiter.acquire()
+        with self._condition:
+            session_key, batch = self._next_batch()
+        self.batches += 1
+        try:
+            self.client.executor.submit(_send, self.client, session_key,
+                                        batch)
+        except Exception as e:
+            # E.g., the client has been closed.
+            for _, future in batch:
+                future.set_exception(e)
+            raise
+
+    def _next_batch(self):
+        """
+        Return the session key on turn and its next batch of plays; the
+        lock is held.
+
+        """
+        while True:
+            session_key = self._active[0]
+            queue = self._queues[session_key]
+            if len(self._active) == 1:
+                # No one to share with, so full batches save calls.
+                self._deficits[session_key] = max(
+                    self._deficits[session_key], MAX_BATCH)
+            elif self._deficits[session_key] < 1:
+                weight = self.weights.get(session_key, self.default_weight)
+                self._deficits[session_key] += self.quantum * weight
+            size = min(len(queue), MAX_BATCH,
+                       int(self._deficits[session_key]))
+            if size:
+                break
+            self._active.rotate(-1)
+        batch = [queue.popleft() for _ in range(size)]
+        self._deficits[session_key] -= size
+        if not queue:
+            # An idle session key does not save up credit.
+            self._active.popleft()
+            del self._queues[session_key]
+            del self._deficits[session_key]
+        elif self._deficits[session_key] < 1:
+            self._active.rotate(-1)
+        return session_key, batch
+
+
+class NowPlayingCoalescer(object):
+    """
+    Holds now-playing updates for up to ``window`` seconds, and only sends
+    the latest one per session key. Skipping through tracks thus results
+    in a single ``track.updateNowPlaying`` call.
+
+    The futures of superseded updates are cancelled.
+
+    """
+
+    def __init__(self, client, window=2.0):
+        """
+        :param client: a `lastfmclient.LastfmClient`
+        :param window: the max. number of seconds an update is held for
+
+        """
+        self.client = client
+        self.window = window
+        self.sent = 0
+        self.superseded = 0
+        # session key => (params, future)
+        self._pending = {}
+        # session key => time by which its update must be sent
+        self._due = {}
+        self._lock = threading.Lock()
+        self._flusher = Periodic(self._flush_due, min(window / 4.0, 1.0),
+                                 name='lastfmclient-now-playing')
+
+    def update_now_playing(self, session_key, artist, track, **params):
+        """
+        Hold a now-playing update for the user with ``session_key``, and
+        return a `concurrent.futures.Future` resolving to the
+        ``track.updateNowPlaying`` response.
+
+        :param params: other ``track.updateNowPlaying`` parameters
+
+        """
+        params = dict(params, artist=artist, track=track)
+        future = Future()
+        with self._lock:
+            previous = self._pending.get(session_key)
+            if previous is None:
+                self._due[session_key] = time.time() + self.window
+            else:
+                self.superseded += 1
+                previous[1].cancel()
+            self._pending[session_key] = (params, future)
+        return future
+
+    def flush(self):
+        """Send all the held updates now."""
+        with self._lock:
+            for session_key in list(self._pending):
+                self._send(session_key)
+
+    def pending(self):
+        """Return the number of held updates."""
+        with self._lock:
+            return len(self._pending)
+
+    def close(self):
+        """Stop the background thread and send the held updates."""
+        self._flusher.stop()
+        self.flush()
+
+    def _flush_due(self):
+        now = time.time()
+        with self._lock:
+            for session_key, due in list(self._due.items()):
+                if due <= now:
+                    self._send(session_key)
+
+    def _send(self, session_key):
+        """Submit the held update of ``session_key``; the lock is held."""
+        params, future = self._pending.pop(session_key)
+        del self._due[session_key]
+        self.sent += 1
+        self.client.executor.submit(_update_now_playing, self.client,
+                                    session_key, params, future)
+
+
+def _update_now_playing(client, session_key, params, future):
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        result = client.for_session(session_key).track.update_now_playing(
+            **params)
+    except Exception as e:
+        future.set_exception(e)
+    else:
+        future.set_result(result)
+
+
+def _check_weight(weight):
+    if not weight > 0:
+        raise ValueError('Weights must be positive: %r' % (weight,))
+    return weight
+
+
+def _make_play(artist, track, timestamp, params):
+    unknown = set(params) - SCROBBLE_PARAMS
+    assert not unknown, 'Unknown parameters: %s' % ', '.join(unknown)
+    return dict(params, artist=artist, track=track, timestamp=timestamp)
+
+
+def _send(client, session_key, batch):
+    """Scrobble a ``batch`` of ``(play, future)`` and resolve the futures."""
+    plays = [play for play, _ in batch]
+    try:
+        result = _scrobble(client, session_key, plays)
+    except Exception as e:
+        for _, future in batch:
+            future.set_exception(e)
+        return
+    scrobbles = _get_scrobbles(result)
+    for i, (_, future) in enumerate(batch):
+        future.set_result(scrobbles[i] if i < len(scrobbles) else None)
+
+
+def _scrobble(client, session_key, plays):
+    """Scrobble the ``plays`` (`dict` objects) in one call."""
+    names = set().union(*plays)
+    params = {name: [play.get(name) for play in plays] for name in names}
+    return client.for_session(session_key).track.scrobble(**params)
@@ -0,0 +1,378 @@
+"""
+Transports perform the HTTP requests for the clients.
+
+A transport takes the final request URL and, for ``POST``, the
+form-encoded body as built by the client, and returns the raw response
+body. Blocking transports return the body directly, non-blocking
+ones return a future (or awaitable) resolving to it. Any transport can be
+passed to any client via the ``transport`` argument.
+
+The Tornado and asyncio transports live in ``lastfmclient.async`` and
+``lastfmclient.aio``, respectively.
+
+"""
+import json
+import sys
+import threading
+
+from .compat import text_type, urlencode, parse_qsl
+from .exceptions import NetworkError
+from .utils import Periodic
+
+
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def encode_params(params):
+    """
+    Return ``params`` URL-encoded as UTF-8. The parameters are sorted, so
+    the result is canonical and can be used as a cache key.
+
+    """
+    return urlencode(sorted((k, text_type(v).encode('utf8'))
+                            for k, v in params.items()))
+
+
+def decode_params(url, body=None):
+    """Return a `dict` of the parameters encoded in ``url`` or ``body``."""
+    if body is None:
+        query = url.partition('?')[2]
+    else:
+        query = body.decode('ascii')
+    return dict(parse_qsl(query))
+
+
+class Transport(object):
+    """Base transport class."""
+
+    def request(self, http_method, url, body=None, timeout=None):
+        """
+        Perform the HTTP request and return the response body.
+
+        Timeouts and connection failures are raised as
+        `lastfmclient.exceptions.NetworkError`, a temporary error.
+
+        :param http_method: the name of the HTTP method
+        :param url: the request URL, including the query string for ``GET``
+        :param body: the form-encoded parameters for ``POST``
+        :type body: bytes
+        :param timeout: timeout for the request in seconds, if any
+
+        """
+        raise NotImplementedError
+
+    def warmup(self, url, n=1):
+        """
+        Open up to ``n`` connections to ``url`` ahead of time and return
+        the number of connections opened.
+
+        """
+        return 0
+
+    def pool_stats(self):
+        """Return a `dict` with connection pool counters, if any."""
+        return {}
+
+    def close(self):
+        """Release all resources held by the transport."""
+
+
+class RequestsTransport(Transport):
+    """
+    Blocking transport using ``requests``.
+
+    Connections are kept alive in a pool shared by all threads using the
+    transport; each thread gets its own ``requests.Session`` mounted on that
+    pool.
+
+    """
+
+    def __init__(self, pool_connections=1, pool_maxsize=10,
+                 idle_check_interval=None):
+        """
+        :param pool_connections: number of per-host pools to keep
+        :param pool_maxsize: max. number of idle keep-alive connections
+                             kept in each pool
+        :param idle_check_interval: if set, check idle connections every
+                                    that many seconds in a background
+                                    thread and drop those closed by the
+                                    server (see `check_idle()`)
+
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self._adapter = None
+        self._adapter_lock = threading.Lock()
+        self._local = threading.local()
+        self._idle_checker = None
+        if idle_check_interval:
+            self._idle_checker = Periodic(
+                self.check_idle, idle_check_interval,
+                name='lastfmclient-idle-checker')
+
+    @property
+    def session(self):
+        """The ``requests.Session`` of the current thread."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            requests = _import('requests')
+            session = requests.Session()
+            adapter = self._get_adapter(requests)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def _get_adapter(self, requests):
+        """Return the connection pool adapter shared by all threads."""
+        with self._adapter_lock:
+            if self._adapter is None:
+                self._adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=self.pool_connections,
+                    pool_maxsize=self.pool_maxsize,
+                )
+            return self._adapter
+
+    def request(self, http_method, url, body=None, timeout=None):
+        headers = FORM_HEADERS if body is not None else None
+        exceptions = _import('requests').exceptions
+        try:
+            response = self.session.request(http_method, url, data=body,
+                                            headers=headers, timeout=timeout)
+        except (exceptions.Timeout, exceptions.ConnectionError) as e:
+            raise NetworkError(str(e))
+        return response.content
+
+    def warmup(self, url, n=1):
+        requests = _import('requests')
+        adapter = self._get_adapter(requests)
+        if hasattr(adapter, 'get_connection_with_tls_context'):
+            # requests >= 2.32 keys its pools on the TLS settings too, so
+            # get the one requests would use (with, e.g., the CA bundle
+            # from the environment).
+            session = self.session
+            request = session.prepare_request(requests.Request('GET', url))
+            settings = session.merge_environment_settings(
+                request.url, {}, None, None, None)
+            pool = adapter.get_connection_with_tls_context(
+                request, settings['verify'], settings['proxies'],
+                settings['cert'])
+        else:
+            pool = adapter.get_connection(url)
+        return _warmup(pool, n)
+
+    def check_idle(self):
+        """Close idle pooled connections that have been dropped by the
+        server and return their number."""
+        if self._adapter is None:
+            return 0
+        return _check_idle(self._adapter.poolmanager)
+
+    def pool_stats(self):
+        """
+        Return a `dict` with connection pool counters:
+
+        ``requests``: requests sent through the pool
+        ``hits``: requests served by an already open connection
+        ``misses``: requests that had to open a new connection
+        ``pools``: number of per-host pools
+
+        """
+        if self._adapter is None:
+            return _pool_stats(None)
+        return _pool_stats(self._adapter.poolmanager)
+
+    def close(self):
+        if self._idle_checker is not None:
+            self._idle_checker.stop()
+        with self._adapter_lock:
+            if self._adapter is not None:
+                self._adapter.close()
+                self._adapter = None
+        self._local = threading.local()
+
+
+class Urllib3Transport(Transport):
+    """
+    Blocking transport using a bare ``urllib3.PoolManager``.
+
+    It is thread-safe and skips the per-request overhead of ``requests``.
+
+    """
+
+    def __init__(self, num_pools=1, maxsize=10, idle_check_interval=None,
+                 **kwargs):
+        """
+        :param num_pools: number of per-host pools to keep
+        :param maxsize: max. number of idle keep-alive connections
+                        kept in each pool
+        :param idle_check_interval: see `RequestsTransport`
+        :param kwargs: passed to ``urllib3.PoolManager``
+
+        """
+        urllib3 = _import('urllib3')
+        self._errors = (urllib3.exceptions.TimeoutError,
+                        urllib3.exceptions.MaxRetryError,
+                        urllib3.exceptions.ProtocolError)
+        self.pool_manager = urllib3.PoolManager(
+            num_pools=num_pools, maxsize=maxsize, **kwargs)
+        self._idle_checker = None
+        if idle_check_interval:
+            self._idle_checker = Periodic(
+                self.check_idle, idle_check_interval,
+                name='lastfmclient-idle-checker')
+
+    def request(self, http_method, url, body=None, timeout=None):
+        headers = FORM_HEADERS if body is not None else None
+        kwargs = {} if timeout is None else {'timeout': timeout}
+        try:
+            return self.pool_manager.urlopen(
+                http_method, url, body=body, headers=headers, **kwargs).data
+        except self._errors as e:
+            raise NetworkError(str(e))
+
+    def warmup(self, url, n=1):
+        return _warmup(self.pool_manager.connection_from_url(url), n)
+
+    def check_idle(self):
+        """See `RequestsTransport.check_idle()`."""
+        return _check_idle(self.pool_manager)
+
+    def pool_stats(self):
+        """See `RequestsTransport.pool_stats()`."""
+        return _pool_stats(self.pool_manager)
+
+    def close(self):
+        if self._idle_checker is not None:
+            self._idle_checker.stop()
+        self.pool_manager.clear()
+
+
+class InMemoryTransport(Transport):
+    """
+    Blocking transport answering from canned responses without any I/O.
+
+    Useful for tests and for measuring the client's own overhead (signing,
+    encoding, parsing). It can be used with the async clients as well.
+
+    """
+
+    #: Returned for methods without a canned response.
+    NOT_FOUND = json.dumps({
+        'error': 3,
+        'message': 'Invalid Method - No method with that name in this package',
+    })
+
+    def __init__(self, responses=None):
+        """
+        :param responses: a `dict` mapping Last.fm method names
+                          (e.g., ``'artist.getInfo'``) to responses.
+                          A response is either the JSON data, or a callable
+                          taking the request params and returning it.
+
+        """
+        self.responses = {}
+        self.calls = 0
+        for method, response in (responses or {}).items():
+            self.add(method, response)
+
+    def add(self, method, response):
+        """Register a canned ``response`` for ``method``."""
+        if not callable(response):
+            # Serialize once so that only parsing is measured per request.
+            response = _constant(json.dumps(response))
+        self.responses[method] = response
+
+    def request(self, http_method, url, body=None, timeout=None):
+        self.calls += 1
+        params = decode_params(url, body)
+        response = self.responses.get(params['method'])
+        if response is None:
+            return self.NOT_FOUND
+        body = response(params)
+        if not isinstance(body, (bytes, text_type)):
+            body = json.dumps(body)
+        return body
+
+
+def _constant(value):
+    return lambda params: value
+
+
+def _iter_pools(pool_manager):
+    pools = getattr(pool_manager, 'pools', {})
+    for key in pools.keys():
+        try:
+            yield pools[key]
+        except KeyError:
+            # Evicted in the meantime.
+            continue
+
+
+def _pool_stats(pool_manager):
+    stats = {'requests': 0, 'hits': 0, 'misses': 0, 'pools': 0}
+    for pool in _iter_pools(pool_manager):
+        stats['pools'] += 1
+        stats['requests'] += pool.num_requests
+        stats['misses'] += pool.num_connections
+    stats['hits'] = max(stats['requests'] - stats['misses'], 0)
+    return stats
+
+
+def _warmup(pool, n):
+    """
+    Connect up to ``n`` new connections and put them in ``pool``, through
+    the ``_get_conn()``/``_put_conn()`` methods its requests use, which
+    have been the same in all ``urllib3`` versions (bundled or not).
+
+    """
+    conns = []
+    try:
+        for _ in range(min(n, pool.pool.maxsize)):
+            conn = pool._get_conn()
+            if conn.sock is None:
+                conn.connect()
+            conns.append(conn)
+    finally:
+        for conn in conns:
+            pool._put_conn(conn)
+    return len(conns)
+
+
+def _check_idle(pool_manager):
+    """Close idle connections dropped by the other side."""
+    dropped = 0
+    for pool in _iter_pools(pool_manager):
+        is_connection_dropped = _get_urllib3(pool).util.is_connection_dropped
+        queue = pool.pool
+        if queue is None:
+            # Closed pool.
+            continue
+        with queue.mutex:
+            # Connections in the queue are not in use by any thread.
+            for conn in queue.queue:
+                if (conn is not None and conn.sock is not None
+                        and is_connection_dropped(conn)):
+                    conn.close()
+                    dropped += 1
+    return dropped
+
+
+def _get_urllib3(pool):
+    """
+    Return the ``urllib3`` package ``pool`` comes from, which is the copy
+    bundled as ``requests.packages.urllib3`` with older ``requests``.
+
+    """
+    package = type(pool).__module__.rpartition('.')[0]
+    return sys.modules[package]
+
+
+def _import(name):
+    try:
+        return __import__(name)
+    except ImportError:
+        raise RuntimeError(
+            'You need to install {name} `pip install {name}` '
+            'to be able to use this transport.'.format(name=name)
+        )
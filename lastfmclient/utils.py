@@ -0,0 +1,72 @@
+import logging
+import threading
+import time
+
+from .compat import monotonic
+
+
+logger = logging.getLogger(__name__)
+
+
+class Periodic(object):
+    """Daemon thread calling ``func`` every ``interval`` seconds."""
+
+    def __init__(self, func, interval, name):
+        self.func = func
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.func()
+            except Exception:
+                # E.g., a database being locked; the next tick may succeed.
+                logger.exception('%s failed', self._thread.name)
+
+    def stop(self):
+        self._stopped.set()
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket: tokens accrue at ``rate`` per second, and up
+    to ``burst`` of them can be saved up.
+
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = float(self.burst)
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate,
+                           self.burst)
+        self._updated = now
+
+    def try_acquire(self, n=1):
+        """Take ``n`` tokens if available, and return ``True`` if so."""
+        with self._lock:
+            self._refill()
+            if self._tokens < n:
+                return False
+            self._tokens -= n
+            return True
+
+    def acquire(self, n=1):
+        """Take ``n`` tokens, waiting for them as long as necessary."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return
+                wait = (n - self._tokens) / self.rate
+            time.sleep(wait)
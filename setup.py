@@ -1,9 +1,18 @@
+import sys
 import codecs
 from setuptools import setup
 
 import lastfmclient
 
 
+install_requires = [
+    'requests>=1.0.4'
+]
+if sys.version_info[0] == 2:
+    # Backport of `concurrent.futures`.
+    install_requires.append('futures')
+
+
 setup(
     name='lastfmclient',
     version=lastfmclient.__version__,
@@ -14,7 +23,5 @@ setup(
     url='https://github.com/jakubroztocil/lastfmclient',
     download_url='https://github.com/jakubroztocil/lastfmclient',
     packages=['lastfmclient'],
-    install_requires=[
-        'requests>=1.0.4'
-    ]
+    install_requires=install_requires,
 )
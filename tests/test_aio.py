@@ -0,0 +1,67 @@
+import asyncio
+import json
+import socket
+import unittest
+
+try:
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    from lastfmclient.aio import AioLastfmClient, HTTPXTransport
+except ImportError:
+    serve = None
+
+
+async def app(scope, receive, send):
+    """A stand-in for the API recording the HTTP versions it is spoken."""
+    if scope['type'] != 'http':
+        return
+    app.http_versions.append(scope['http_version'])
+    body = json.dumps({'artist': {'name': 'Radiohead'}}).encode('utf8')
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@unittest.skipIf(serve is None, 'Needs aiohttp, httpx[http2] and hypercorn.')
+class HTTPXTransportTestCase(unittest.TestCase):
+
+    def test_http2_prior_knowledge(self):
+        app.http_versions = []
+        infos = asyncio.run(self.fetch(10))
+        self.assertEqual(infos, [{'name': 'Radiohead'}] * 10)
+        self.assertEqual(set(app.http_versions), {'2'})
+
+    async def fetch(self, n):
+        config = Config()
+        config.bind = ['127.0.0.1:%d' % get_free_port()]
+        shutdown = asyncio.Event()
+        server = asyncio.ensure_future(
+            serve(app, config, shutdown_trigger=shutdown.wait))
+        await asyncio.sleep(0.2)
+        api = AioLastfmClient(
+            api_key='key', api_secret='secret',
+            api_url='http://%s/2.0/' % config.bind[0],
+            transport=HTTPXTransport(http2=True, prior_knowledge=True),
+        )
+        try:
+            return await asyncio.gather(*[
+                api.artist.get_info('Radiohead') for _ in range(n)])
+        finally:
+            await api.close()
+            shutdown.set()
+            await server
+
+
+if __name__ == '__main__':
+    unittest.main()
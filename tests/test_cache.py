@@ -0,0 +1,31 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lastfmclient.cache import SQLiteCache
+
+
+class SQLiteCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_compact_shrinks_file(self):
+        cache = SQLiteCache(self.path)
+        for i in range(500):
+            cache.set('method=artist.getInfo&artist=%d' % i, 'x' * 10000)
+        cache.compact()
+        full = os.path.getsize(self.path)
+        cache.clear()
+        cache.compact()
+        self.assertLess(os.path.getsize(self.path), full / 10)
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lastfmclient import LastfmClient
+from lastfmclient.api import CACHE_TTL
+from lastfmclient.cache import CorrectionMemo, MemoryCache
+from lastfmclient.transports import InMemoryTransport
+
+
+def get_artist_info(params):
+    return {'artist': {'name': params['artist']}}
+
+
+class CorrectionsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.corrections = CorrectionMemo(os.path.join(self.dir, 'memo.db'))
+        self.corrections.set(
+            'artist.getCorrection', {'artist': 'beatles'},
+            {'correction': {'artist': {'name': 'The Beatles'}}})
+        self.transport = InMemoryTransport({
+            'artist.getInfo': get_artist_info,
+        })
+        self.api = LastfmClient(
+            api_key='key', api_secret='secret', transport=self.transport,
+            cache=MemoryCache(), normalize_names=True,
+            corrections=self.corrections)
+
+    def tearDown(self):
+        self.corrections.close()
+        shutil.rmtree(self.dir)
+
+    def test_autocorrect_shares_canonical_entry(self):
+        self.api.artist.get_info('The Beatles', autocorrect=1)
+        info = self.api.artist.get_info('beatles', autocorrect=1)
+        self.assertEqual(info['name'], 'The Beatles')
+        self.assertEqual(self.transport.calls, 1)
+
+    def test_autocorrect_0_is_not_corrected(self):
+        self.api.artist.get_info('The Beatles', autocorrect=0)
+        info = self.api.artist.get_info('beatles', autocorrect=0)
+        self.assertEqual(info['name'], 'beatles')
+        self.assertEqual(self.transport.calls, 2)
+
+    def test_write_invalidates_corrected_entries(self):
+        self.transport.add('track.getInfo', lambda params: {
+            'track': {'name': params['track'],
+                      'artist': {'name': params['artist']}}})
+        self.transport.add('track.love', {})
+        self.corrections.set(
+            'track.getCorrection', {'artist': 'beatles', 'track': 'help'},
+            {'correction': {'track': {'name': 'Help!', 'artist': {
+                'name': 'The Beatles'}}}})
+        self.api.track.get_info('The Beatles', 'Help!', autocorrect=1)
+        self.api.track.get_info('beatles', 'help', autocorrect=1)
+        self.assertEqual(self.transport.calls, 1)
+        self.api.for_session('sk').track.love('beatles', 'help')
+        self.api.track.get_info('beatles', 'help', autocorrect=1)
+        self.assertEqual(self.transport.calls, 3)
+
+
+class CacheTTLTestCase(unittest.TestCase):
+
+    def get_ttl(self, cache, cache_ttl=None):
+        api = LastfmClient(api_key='key', api_secret='secret',
+                           transport=InMemoryTransport(), cache=cache,
+                           cache_ttl=cache_ttl)
+        return api._get_cache_ttl('artist.getInfo')
+
+    def test_method_default(self):
+        self.assertEqual(self.get_ttl(MemoryCache()),
+                         CACHE_TTL['artist.getInfo'])
+
+    def test_cache_ttl_overrides_default(self):
+        self.assertEqual(self.get_ttl(MemoryCache(ttl=600)), 600)
+
+    def test_client_cache_ttl_overrides_cache_ttl(self):
+        self.assertEqual(
+            self.get_ttl(MemoryCache(ttl=600), {'artist.getInfo': 60}), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import threading
+import time
+import unittest
+
+from lastfmclient.hedging import HedgingExecutor, HedgingPolicy, hedge
+
+
+class HedgeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = HedgingExecutor(4)
+        self.policy = HedgingPolicy(initial_delay=0.05, budget=1)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def request(self):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        if call == 1:
+            time.sleep(1)
+            return 'primary'
+        return 'duplicate'
+
+    def test_fast_duplicate_wins_over_slow_primary(self):
+        started = time.time()
+        result = hedge(self.executor, self.policy, self.request)
+        self.assertEqual(result, 'duplicate')
+        self.assertLess(time.time() - started, 0.5)
+        self.assertEqual(self.policy.stats()['hedges'], 1)
+
+    def test_fast_primary_is_not_hedged(self):
+        self.calls = 1
+        result = hedge(self.executor, self.policy, self.request)
+        self.assertEqual(result, 'duplicate')
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.policy.stats()['hedges'], 0)
+
+    def test_busy_executor_runs_request_unhedged(self):
+        release = threading.Event()
+        for _ in range(4):
+            self.executor.try_submit(release.wait)
+        self.calls = 1
+        try:
+            self.assertEqual(
+                hedge(self.executor, self.policy, self.request), 'duplicate')
+        finally:
+            release.set()
+        self.assertEqual(self.policy.stats()['requests'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lastfmclient import LastfmClient
+from lastfmclient.scrobbling import ScrobbleQueue
+from lastfmclient.transports import InMemoryTransport
+
+
+class ScrobbleQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'scrobbles.db')
+        self.error = None
+        self.transport = InMemoryTransport({'track.scrobble': self.scrobble})
+        self.api = LastfmClient(api_key='key', api_secret='secret',
+                                transport=self.transport)
+        self.queues = []
+
+    def tearDown(self):
+        for queue in self.queues:
+            queue.close()
+        shutil.rmtree(self.dir)
+
+    def scrobble(self, params):
+        if self.error:
+            return {'error': self.error, 'message': 'Failed'}
+        return {'scrobbles': {'@attr': {'accepted': 1, 'ignored': 0}}}
+
+    def get_queue(self, **kwargs):
+        # Drained explicitly.
+        queue = ScrobbleQueue(self.api, self.path, drain_interval=3600,
+                              **kwargs)
+        self.queues.append(queue)
+        return queue
+
+    def test_duplicates_are_ignored(self):
+        queue = self.get_queue()
+        self.assertTrue(queue.scrobble('sk', 'Cher', 'Believe', 1).result())
+        self.assertFalse(queue.scrobble('sk', 'Cher', 'Believe', 1).result())
+        self.assertEqual(queue.drain(), 1)
+        self.assertFalse(queue.scrobble('sk', 'Cher', 'Believe', 1).result())
+        self.assertEqual(queue.pending(), 0)
+
+    def test_pending_plays_are_replayed_after_restart(self):
+        queue = self.get_queue()
+        queue.scrobble('sk', 'Cher', 'Believe', 1).result()
+        queue.close()
+        self.queues.remove(queue)
+        queue = self.get_queue()
+        self.assertEqual(queue.pending(), 1)
+        self.assertEqual(queue.drain(), 1)
+        self.assertEqual(self.transport.calls, 1)
+
+    def test_new_plays_wait_for_backoff(self):
+        queue = self.get_queue(min_backoff=60)
+        self.error = 11
+        for i in range(5):
+            queue.scrobble('sk', 'Cher', 'Believe', i).result()
+            queue.drain()
+        self.assertEqual(self.transport.calls, 1)
+        self.assertEqual(queue.pending(), 5)
+        # Other users are not held up.
+        self.error = None
+        queue.scrobble('other', 'Blur', 'Song 2', 1).result()
+        self.assertEqual(queue.drain(), 1)
+
+    def test_refused_plays_fail(self):
+        queue = self.get_queue()
+        self.error = 6
+        queue.scrobble('sk', 'Cher', 'Believe', 1).result()
+        self.assertEqual(queue.drain(), 0)
+        self.assertEqual(queue.pending(), 0)
+        self.assertEqual(len(queue.failed()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
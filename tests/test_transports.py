@@ -0,0 +1,91 @@
+import json
+import socket
+import threading
+import time
+import unittest
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from lastfmclient.exceptions import NetworkError, TemporaryError
+from lastfmclient.transports import RequestsTransport, Urllib3Transport
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        if 'slow' in self.path:
+            time.sleep(0.5)
+        body = json.dumps({'artist': {'name': 'Radiohead'}}).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    connections = 0
+
+    def handle_error(self, request, client_address):
+        # E.g., a client having timed out.
+        pass
+
+
+class RequestsTransportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/2.0/' % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_requests_reuse_warmed_connections(self):
+        transport = RequestsTransport(pool_maxsize=3)
+        self.assertEqual(transport.warmup(self.url, 3), 3)
+        for _ in range(3):
+            transport.request('GET', self.url + '?method=artist.getInfo')
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(transport.pool_stats()['pools'], 1)
+        transport.close()
+
+    def test_timeout_is_network_error(self):
+        for transport in [RequestsTransport(), Urllib3Transport(retries=0)]:
+            with self.assertRaises(NetworkError) as context:
+                transport.request('GET', self.url + '?artist=slow',
+                                  timeout=0.1)
+            self.assertIsInstance(context.exception, TemporaryError)
+            transport.close()
+
+    def test_connection_error_is_network_error(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        # Nothing listens on the port.
+        url = 'http://127.0.0.1:%d/2.0/' % sock.getsockname()[1]
+        sock.close()
+        for transport in [RequestsTransport(), Urllib3Transport(retries=0)]:
+            with self.assertRaises(NetworkError):
+                transport.request('GET', url)
+            transport.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
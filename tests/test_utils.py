@@ -0,0 +1,28 @@
+import threading
+import unittest
+
+from lastfmclient.utils import Periodic
+
+
+class PeriodicTestCase(unittest.TestCase):
+
+    def test_failing_tick_does_not_stop_later_ones(self):
+        ticks = []
+        done = threading.Event()
+
+        def tick():
+            ticks.append(len(ticks))
+            if len(ticks) == 1:
+                raise RuntimeError('database is locked')
+            done.set()
+
+        periodic = Periodic(tick, 0.01, name='test-periodic')
+        try:
+            self.assertTrue(done.wait(5))
+        finally:
+            periodic.stop()
+        self.assertGreaterEqual(len(ticks), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()